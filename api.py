@@ -1,64 +1,110 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from atproto import Client, models
 import os
-import mysql.connector
+import hmac
 import time
 import json
+import threading
 from datetime import datetime, timezone
 
+import db
+import did_resolver
+import label_store
+import profiler
+import writer_pool
+from coalesce import SingleFlight
+from export_labels import iter_labels
+from db import get_db_connection, get_read_connection
+
 app = Flask(__name__)
 CORS(app)
+profiler.install(app)
+
+# DID do labeler usado como 'src' quando ainda não há sessão Bluesky
+DEFAULT_LABELER_DID = os.getenv('LABELER_DID', 'did:plc:bmx5j2ukbbixbn4lo5itsf5v')
+
+# Coalescing de lookups idênticos no queryLabels
+label_lookups = SingleFlight(timeout=float(os.getenv('COALESCE_TIMEOUT', 5)))
 
 # Cliente Bluesky (singleton)
+# O pacote atproto (e todos os modelos pydantic) só é importado aqui dentro,
+# para que a rota de leitura (queryLabels) e o boot dos workers não paguem esse custo.
 client = None
+_client_lock = threading.Lock()
 
 def get_client():
     """Get authenticated Bluesky client"""
     global client
     
-    if client is None:
-        client = Client()
-        handle = os.getenv('BLUESKY_HANDLE', 'labeler.boio.la')
-        password = os.getenv('BLUESKY_PASSWORD')
+    # Com workers gthread vários requests podem chegar aqui juntos: um login só
+    with _client_lock:
+        if client is None:
+            from atproto import Client
+            client = Client()
+            handle = os.getenv('BLUESKY_HANDLE', 'labeler.boio.la')
+            password = os.getenv('BLUESKY_PASSWORD')
         
-        if not password:
-            raise ValueError('BLUESKY_PASSWORD not set')
+            if not password:
+                raise ValueError('BLUESKY_PASSWORD not set')
         
-        try:
-            client.login(handle, password)
-            print(f"✅ Logged in as {handle}")
             try:
-                print(f"   DID: {client.me.did}")
-            except:
-                pass
-        except Exception as e:
-            print(f"❌ Login failed: {e}")
-            raise
+                with profiler.timed('xrpc', 'com.atproto.server.createSession'):
+                    client.login(handle, password)
+                print(f"✅ Logged in as {handle}")
+                try:
+                    print(f"   DID: {client.me.did}")
+                except:
+                    pass
+            except Exception as e:
+                print(f"❌ Login failed: {e}")
+                raise
     
     return client
 
-def get_db_connection():
-    """Establish database connection"""
+def get_labeler_did():
+    """DID do labeler sem forçar login (não importa atproto)"""
     try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME'),
-            connect_timeout=10
-        )
-        return connection
-    except Exception as e:
-        print(f"❌ Database connection failed: {e}")
-        raise e
+        if client is not None and client.me:
+            return client.me.did
+    except:
+        pass
+    return DEFAULT_LABELER_DID
+
+def reset_after_fork():
+    """
+    Chamado pelo gunicorn (post_fork) quando preload_app está ativo.
+    Sessões HTTP e sockets do MySQL não podem ser compartilhados entre processos,
+    então cada worker começa com o seu próprio estado.
+    """
+    global client, _client_lock, label_lookups
+    client = None
+    _client_lock = threading.Lock()
+    label_lookups = SingleFlight(timeout=label_lookups.timeout)
+    db.reset_after_fork()
+    label_store.reset_after_fork()
+    did_resolver.reset_after_fork()
+    writer_pool.reset_after_fork()
 
 def apply_label_via_repo(subject_did, badge_name, negate=False):
     """
     Cria ou remove um label gravando DIRETAMENTE no Repositório do Labeler.
     (Self-Labeling / Repo Labeler)
+    Com LABELER_WRITERS, a escrita vai para a conta escolhida por hash do DID (writer_pool).
     """
-    c = get_client()
+    try:
+        with writer_pool.get_pool(get_client).session_for(subject_did) as c:
+            return _create_label_record(c, subject_did, badge_name, negate)
+    except Exception as e:
+        print(f"❌ Error in create_record: {e}")
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+def _create_label_record(c, subject_did, badge_name, negate):
+    """Grava o record de label no repo de `c` (levanta exceção em caso de erro)"""
+    from atproto import models
+
     now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
     
     action_name = "REMOVING" if negate else "ADDING"
@@ -66,8 +112,9 @@ def apply_label_via_repo(subject_did, badge_name, negate=False):
 
     # 1. Criar o objeto Label usando o Modelo Oficial
     # Fix: Usar a classe aninhada ComAtprotoLabelDefs.Label
+    # O record vai para o repo da conta escritora (c), mas quem emite o label é o labeler
     label_record = models.ComAtprotoLabelDefs.Label(
-        src=c.me.did,
+        src=get_labeler_did(),
         uri=subject_did,
         val=badge_name,
         neg=negate,
@@ -96,48 +143,41 @@ def apply_label_via_repo(subject_did, badge_name, negate=False):
 
     print(f"📦 JSON Record Payload: {json.dumps(record_dict)}")
 
-    try:
-        print(f"📤 Sending create_record to Self Repo...")
-        
-        # 3. Enviar
+    print(f"📤 Sending create_record to Self Repo...")
+    
+    # 3. Enviar
+    with profiler.timed('xrpc', 'com.atproto.repo.createRecord'):
         response = c.com.atproto.repo.create_record(data=data_payload)
-        
-        # Parse Response
-        new_uri = getattr(response, 'uri', '')
-        new_cid = getattr(response, 'cid', '')
-        rkey = new_uri.split('/')[-1] if new_uri else 'unknown'
-        
-        print(f"✅ Success! URI: {new_uri} | CID: {new_cid}")
-
-        # --- SIMULACAO JETSTREAM (O que a rede verá) ---
-        js_event = {
-            "did": c.me.did,
-            "kind": "commit",
-            "commit": {
-                "operation": "create",
-                "collection": "com.atproto.label.defs",
-                "rkey": rkey,
-                "record": record_dict, # Strict JSON we built earlier
-                "cid": new_cid
-            }
-        }
-        print(f"🌊 Jetstream Event Simulation:\n{json.dumps(js_event, indent=2)}")
-        # ---------------------------------------------
-
-        return {
-            "success": True,
-            "uri": new_uri,
-            "cid": new_cid,
+    
+    # Parse Response
+    new_uri = getattr(response, 'uri', '')
+    new_cid = getattr(response, 'cid', '')
+    rkey = new_uri.split('/')[-1] if new_uri else 'unknown'
+    
+    print(f"✅ Success! URI: {new_uri} | CID: {new_cid}")
+
+    # --- SIMULACAO JETSTREAM (O que a rede verá) ---
+    js_event = {
+        "did": c.me.did,
+        "kind": "commit",
+        "commit": {
+            "operation": "create",
+            "collection": "com.atproto.label.defs",
             "rkey": rkey,
-            "jetstream_simulation": js_event
-        }
-        
-    except Exception as e:
-        print(f"❌ Error in create_record: {e}")
-        return {
-            "success": False,
-            "error": str(e)
+            "record": record_dict, # Strict JSON we built earlier
+            "cid": new_cid
         }
+    }
+    print(f"🌊 Jetstream Event Simulation:\n{json.dumps(js_event, indent=2)}")
+    # ---------------------------------------------
+
+    return {
+        "success": True,
+        "uri": new_uri,
+        "cid": new_cid,
+        "rkey": rkey,
+        "jetstream_simulation": js_event
+    }
 
 
 # ============================================================================
@@ -148,61 +188,136 @@ def query_labels():
     uri_patterns = request.args.getlist('uriPatterns')
     labels = []
     
-    # Tenta pegar DID do labeler
-    try:
-        c = get_client()
-        my_did = c.me.did
-    except:
-        my_did = "did:plc:bmx5j2ukbbixbn4lo5itsf5v" # Fallback DID
+    # DID do labeler (sem login: a leitura não deve importar o atproto)
+    my_did = get_labeler_did()
+
+    # Réplica local (SQLite): responde sem ir ao MySQL, inclusive se ele estiver fora.
+    # DIDs recém alterados vão direto ao banco (read-your-writes).
+    dids = [p for p in uri_patterns if p.startswith('did:')]
+    if label_store.enabled() and not db.recently_written(dids):
+        label_store.ensure_sync_thread()
+        try:
+            age = label_store.staleness()
+            if age is not None:
+                for did in dids:
+                    for val, cts in label_store.query(did):
+                        labels.append({
+                            "src": my_did,
+                            "uri": did,
+                            "val": val,
+                            "cts": cts,
+                            "ver": 1
+                        })
+                response = jsonify({"cursor": "0", "labels": labels})
+                response.headers['X-Labels-Staleness'] = f"{age:.1f}"
+                return response
+        except Exception as e:
+            print(f"⚠️ Local store indisponível, consultando MySQL: {e}")
+            labels = []
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"cursor": "0", "labels": []})
+    # Lookups concorrentes pelo mesmo DID (post viral) compartilham UMA query.
+    # A conexão só é aberta se este request for o leader de algum DID.
+    conn = None
 
-    try:
+    def fetch_did_labels(did):
+        nonlocal conn
+        if conn is None:
+            conn = get_read_connection(uri_patterns)
         cursor = conn.cursor(dictionary=True)
-        
-        for pattern in uri_patterns:
-            if pattern.startswith('did:'):
-                # A MESMA QUERY PODEROSA QUE USA AS 3 TABELAS
-                query = """
-                    SELECT bb.label_id, ub.created_at
-                    FROM user_badges ub
-                    JOIN bluesky_badges bb ON ub.badge_id = bb.id
-                    JOIN user_bluesky_profiles ubp ON ub.user_id = ubp.user_id
-                    WHERE ubp.bluesky_did = %s
-                """
-                
-                cursor.execute(query, (pattern,))
-                results = cursor.fetchall()
-                
-                for row in results:
-                    cts = datetime.now(timezone.utc).isoformat()
-                    if row.get('created_at'):
-                        try:
-                            # Tenta converter se for objeto datetime
-                            cts = row['created_at'].isoformat() + "Z"
-                        except:
-                            # Se já for string
-                            cts = str(row['created_at'])
-                    
-                    labels.append({
-                        "src": my_did,
-                        "uri": pattern,
-                        "val": row['label_id'],
-                        "cts": cts,
-                        "ver": 1
-                    })
-        
+        # A MESMA QUERY PODEROSA QUE USA AS 3 TABELAS
+        query = """
+            SELECT bb.label_id, ub.created_at
+            FROM user_badges ub
+            JOIN bluesky_badges bb ON ub.badge_id = bb.id
+            JOIN user_bluesky_profiles ubp ON ub.user_id = ubp.user_id
+            WHERE ubp.bluesky_did = %s
+        """
+        with profiler.timed('sql', 'queryLabels: labels by DID'):
+            cursor.execute(query, (did,))
+            results = cursor.fetchall()
         cursor.close()
-        conn.close()
-    
+
+        rows = []
+        for row in results:
+            cts = datetime.now(timezone.utc).isoformat()
+            if row.get('created_at'):
+                try:
+                    # Tenta converter se for objeto datetime
+                    cts = row['created_at'].isoformat() + "Z"
+                except:
+                    # Se já for string
+                    cts = str(row['created_at'])
+            rows.append((row['label_id'], cts))
+        # Tupla: o mesmo resultado é entregue a vários requests
+        return tuple(rows)
+
+    try:
+        for did in dids:
+            # DIDs recém alterados leem do primário: não podem pegar carona numa leitura de réplica
+            key = (did, db.recently_written([did]))
+            for val, cts in label_lookups.do(key, lambda: fetch_did_labels(did)):
+                labels.append({
+                    "src": my_did,
+                    "uri": did,
+                    "val": val,
+                    "cts": cts,
+                    "ver": 1
+                })
     except Exception as e:
         print(f"❌ Erro na Query de Leitura: {e}")
+    finally:
         if conn and conn.is_connected(): conn.close()
 
     return jsonify({"cursor": "0", "labels": labels})
 
+@app.route('/stats')
+def stats():
+    # Expõe handles e saúde das contas escritoras: só admin
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    writers = writer_pool.get_pool(get_client)
+    return jsonify({
+        'label_lookups': label_lookups.snapshot(),
+        'writers': writers.status()
+    })
+
+def is_admin():
+    """Checa o token admin (header X-Admin-Token) contra ADMIN_TOKEN"""
+    token = os.getenv('ADMIN_TOKEN')
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def admin_profiling():
+    """
+    GET: resumo (top funções + chamadas SQL/XRPC lentas). ?route=/debug filtra por rota.
+    POST: {"enabled": true, "sample_rate": 0.05, "routes": {...}, "slow_ms": 50}
+    """
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+        try:
+            cfg = profiler.set_config(
+                enabled=data.get('enabled'),
+                sample_rate=data.get('sample_rate'),
+                routes=data.get('routes'),
+                slow_ms=data.get('slow_ms')
+            )
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        print(f"🔬 Profiling {'ATIVADO' if cfg['enabled'] else 'DESATIVADO'} (sample rate: {cfg['sample_rate']})")
+        return jsonify({'success': True, 'config': cfg, 'pinned_by_env': sorted(profiler.pinned)})
+
+    try:
+        limit = max(1, int(request.args.get('limit', 20)))
+    except ValueError:
+        return jsonify({'success': False, 'error': "'limit' must be an integer"}), 400
+    return jsonify(profiler.summary(limit=limit, route=request.args.get('route')))
+
 @app.route('/')
 def home():
     return jsonify({
@@ -334,17 +449,13 @@ def debug_page():
     try:
         c = get_client()
         if c.me.did:
-             # Resolver o DID Document publicamente
-             # Usando o diretório PLC ou via client
-             did_doc_url = f"https://plc.directory/{c.me.did}"
+             # Resolver o DID Document publicamente (resolver com cache e timeout)
+             did_doc_url = did_resolver.did_document_url(c.me.did)
              html_output += f"<div><strong>DID:</strong> {c.me.did}</div>"
              html_output += f"<div style='margin-bottom:10px;'><a href='{did_doc_url}' target='_blank' style='color:#60a5fa'>Ver no PLC Directory ↗</a></div>"
              
-             # Tentar fetch manual do JSON
-             import requests
-             res = requests.get(did_doc_url)
-             if res.status_code == 200:
-                 doc = res.json()
+             doc = did_resolver.resolve(c.me.did)
+             if doc:
                  services = doc.get('service', [])
                  
                  found_labeler = False
@@ -376,6 +487,19 @@ def debug_page():
                  html_output += "<div>❌ Falha ao buscar DID Doc no PLC.</div>"
     except Exception as e:
         html_output += f"<div>Erro ao inspecionar DID Doc: {str(e)}</div>"
+
+    # DID alvo (?did=): existe? qual o handle declarado?
+    try:
+        target_doc = did_resolver.resolve(TARGET_DID)
+        if target_doc:
+            html_output += f"<div style='margin-top:10px;'>🎯 DID alvo resolvido: <code>{TARGET_DID}</code> → <strong>{did_resolver.get_handle(target_doc) or '(sem handle)'}</strong></div>"
+        else:
+            html_output += f"<div style='margin-top:10px;' class='status-err'>🎯 DID alvo NÃO existe: <code>{TARGET_DID}</code></div>"
+    except did_resolver.InvalidDID as e:
+        html_output += f"<div style='margin-top:10px;' class='status-err'>🎯 DID alvo inválido: <code>{TARGET_DID}</code> ({e})</div>"
+    except did_resolver.DIDResolutionError as e:
+        html_output += f"<div style='margin-top:10px;' class='status-missing'>🎯 Não foi possível resolver o DID alvo agora: {e}</div>"
+    html_output += f"<div style='color:#64748b; font-size:0.85em;'>Cache de DIDs: {did_resolver.cache_stats()['size']} entradas</div>"
     html_output += "</div>"
 
     html_output += "<h2>2. Conexão MySQL</h2><div class='card'>"
@@ -387,6 +511,16 @@ def debug_page():
         html_output += f"<div>Status: <span class='status-ok'>CONNECTED</span></div>"
         html_output += f"<div>Latency: {latency:.2f}ms</div>"
         html_output += f"<div>Server Info: {conn.get_server_info()}</div>"
+        if label_store.enabled():
+            age = label_store.staleness()
+            age_str = f"{age:.1f}s" if age is not None else "nunca sincronizado"
+            html_output += f"<div>Réplica local (SQLite): {label_store.STORE_PATH} (staleness: {age_str})</div>"
+        replicas = db.get_replica_hosts()
+        if replicas:
+            html_output += f"<div>Réplicas de leitura: {len(replicas)}</div>"
+            for key, st in db.get_replica_status().items():
+                st_class = 'status-ok' if st['healthy'] else 'status-err'
+                html_output += f"<div>&nbsp;&nbsp;{key}: <span class='{st_class}'>{'OK' if st['healthy'] else 'FORA'}</span> (lag: {st['lag']})</div>"
     except Exception as e:
         html_output += f"<div>Status: <span class='status-err'>FAILED</span></div>"
         html_output += f"<div>Error: {str(e)}</div>"
@@ -397,7 +531,7 @@ def debug_page():
     html_output += f"<p style='color:#b45309'>Consulta direta para DID: {TARGET_DID}</p>"
     
     try:
-        raw_conn = get_db_connection()
+        raw_conn = get_read_connection([TARGET_DID])
         if raw_conn:
             raw_cursor = raw_conn.cursor(dictionary=True)
             
@@ -442,7 +576,7 @@ def debug_page():
     # 2.6 Inspeção de Definição de Badges (IDs 8 e 13)
     html_output += f"<h2>2.6 Definição de Badges (Tabela bluesky_badges)</h2><div class='card' style='background: #e0e7ff; border-color: #6366f1;'>"
     try:
-        def_conn = get_db_connection()
+        def_conn = get_read_connection()
         if def_conn:
             def_cursor = def_conn.cursor(dictionary=True)
             def_cursor.execute("SELECT id, badge_name, label_id, created_at FROM bluesky_badges WHERE id IN (8, 13)")
@@ -589,7 +723,7 @@ def debug_page():
     
     # Abrir nova conexão específica para auditoria
     try:
-        audit_conn = get_db_connection()
+        audit_conn = get_read_connection()
         if audit_conn:
             audit_cursor = audit_conn.cursor(dictionary=True)
             # Query já definida abaixo...
@@ -717,6 +851,63 @@ def debug_page():
     
     return html_output
 
+@app.route('/admin/export-labels')
+def admin_export_labels():
+    """
+    Export NDJSON de todos os labels atuais, em streaming (memória constante).
+    ?after=<cursor> retoma; cada resposta dura no máximo EXPORT_MAX_SECONDS para não
+    estourar o timeout do worker e, se não terminou, a última linha é {"next_cursor": N}.
+    """
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    after = request.args.get('after', 0, type=int)
+    max_rows = request.args.get('limit', type=int)
+    deadline = time.monotonic() + float(os.getenv('EXPORT_MAX_SECONDS', 20))
+
+    def generate():
+        conn = get_read_connection()
+        try:
+            rows = iter_labels(conn, after=after, max_rows=max_rows, deadline=deadline)
+            while True:
+                try:
+                    label = next(rows)
+                except StopIteration as stop:
+                    last_cursor, finished = stop.value
+                    break
+                yield json.dumps(label) + "\n"
+            if not finished:
+                yield json.dumps({"next_cursor": last_cursor}) + "\n"
+        finally:
+            conn.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def note_badge_write(did):
+    """Depois de uma escrita bem-sucedida: read-your-writes e réplica local em dia para o DID"""
+    db.note_write(did)
+    if label_store.enabled():
+        try:
+            label_store.refresh_did(did)
+        except Exception as e:
+            print(f"⚠️ Local store: não foi possível atualizar {did}: {e}")
+
+def validate_did(did):
+    """
+    Confere se o DID existe (resolver com cache). Retorna a mensagem de erro ou None.
+    Falhas de rede não bloqueiam a escrita: o PLC fora do ar não pode parar os badges.
+    """
+    if os.getenv('VALIDATE_DIDS', '1') != '1':
+        return None
+    try:
+        if did_resolver.resolve(did) is None:
+            return 'DID not found'
+    except did_resolver.InvalidDID as e:
+        return str(e)
+    except did_resolver.DIDResolutionError as e:
+        print(f"⚠️ Não foi possível validar {did}, seguindo assim mesmo: {e}")
+    return None
+
 @app.route('/apply-badge', methods=['POST'])
 def apply_badge():
     try:
@@ -729,6 +920,10 @@ def apply_badge():
         
         if not user_did.startswith('did:'):
             return jsonify({'success': False, 'error': 'Invalid DID format'}), 400
+
+        error = validate_did(user_did)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
             
         print(f"\n{'='*60}\n📝 APPLYING BADGE\n   User: {user_did}\n   Badge: {label_value}\n{'='*60}\n")
         
@@ -736,6 +931,7 @@ def apply_badge():
         result = apply_label_via_repo(user_did, label_value, negate=False)
         
         if result['success']:
+            note_badge_write(user_did)
             return jsonify({
                 'success': True,
                 'message': f'Badge "{label_value}" aplicado com sucesso',
@@ -764,6 +960,7 @@ def remove_badge():
         result = apply_label_via_repo(user_did, label_value, negate=True)
         
         if result['success']:
+            note_badge_write(user_did)
             return jsonify({'success': True, 'message': 'Badge removido com sucesso'})
         else:
             return jsonify({'success': False, 'error': result['error']}), 500
@@ -0,0 +1,68 @@
+"""
+Benchmark de startup do api.py
+Mede o tempo de import e o tempo até a primeira requisição servida
+(queryLabels), cada medição num processo Python novo.
+
+Uso: python bench_startup.py [rodadas]
+"""
+
+import os
+import subprocess
+import sys
+import json
+import statistics
+
+PROBE = r"""
+import sys, time, json
+t0 = time.perf_counter()
+import api
+t_import = time.perf_counter() - t0
+
+# Conexão falsa (sem MySQL): o request percorre o caminho normal até o fim
+class FakeCursor:
+    def execute(self, query, params=None): pass
+    def fetchall(self): return []
+    def close(self): pass
+
+class FakeConnection:
+    def cursor(self, **kwargs): return FakeCursor()
+    def is_connected(self): return True
+    def close(self): pass
+
+api.get_read_connection = lambda dids=(): FakeConnection()
+t1 = time.perf_counter()
+res = api.app.test_client().get('/xrpc/com.atproto.label.queryLabels?uriPatterns=did:plc:bench')
+t_first = time.perf_counter() - t1
+
+print(json.dumps({
+    "import_ms": t_import * 1000,
+    "first_request_ms": t_first * 1000,
+    "total_ms": (time.perf_counter() - t0) * 1000,
+    "status": res.status_code,
+    "atproto_loaded": "atproto" in sys.modules,
+}))
+"""
+
+
+def run_once():
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=here, capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = [run_once() for _ in range(rounds)]
+
+    print(f"\n⏱️  STARTUP BENCHMARK ({rounds} rodadas)")
+    for key in ("import_ms", "first_request_ms", "total_ms"):
+        values = [r[key] for r in results]
+        print(f"   {key:<18} mediana {statistics.median(values):8.1f}ms | min {min(values):8.1f}ms")
+    print(f"   atproto importado na leitura: {'SIM ❌' if any(r['atproto_loaded'] for r in results) else 'NÃO ✅'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark do writer_pool contra um PDS FALSO local
+
+O PDS falso aceita createSession/getProfile/createRecord e limita cada conta a
+--rate escritas por segundo (como o rate limit de escrita de um PDS real), então
+o throughput só cresce adicionando contas.
+
+Uso: python bench_writers.py [--writes 600] [--rate 50] [--accounts 1,2,4] [--threads 32]
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from writer_pool import WriterAccount, WriterPool, WriterState
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+
+
+def fake_jwt(did):
+    # O atproto decodifica os três segmentos do token: a assinatura precisa ser base64url válido
+    header = _b64({'alg': 'ES256K', 'typ': 'at+jwt'})
+    payload = _b64({'sub': did, 'exp': int(time.time()) + 3600, 'scope': 'com.atproto.access'})
+    signature = base64.urlsafe_b64encode(b'\x00' * 64).decode().rstrip('=')
+    return f"{header}.{payload}.{signature}"
+
+
+class FakePDS:
+    """Estado do PDS falso: uma 'fila' serializada por conta, a `rate` escritas/s"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.locks = {}
+        self.records = []  # (account did, subject did)
+        self.lock = threading.Lock()
+
+    def account_lock(self, did):
+        with self.lock:
+            return self.locks.setdefault(did, threading.Lock())
+
+
+def make_handler(pds):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _caller(self):
+            token = self.headers.get('Authorization', '').split(' ')[-1]
+            payload = token.split('.')[1]
+            return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['sub']
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def do_GET(self):
+            if self.path.startswith('/xrpc/app.bsky.actor.getProfile'):
+                did = self._caller()
+                return self._send(200, {'did': did, 'handle': did.split(':')[-1] + '.test'})
+            self._send(404, {'error': 'MethodNotImplemented'})
+
+        def do_POST(self):
+            if self.path == '/xrpc/com.atproto.server.createSession':
+                handle = self._body()['identifier']
+                did = f"did:plc:{handle.split('.')[0]}"
+                return self._send(200, {
+                    'did': did, 'handle': handle,
+                    'accessJwt': fake_jwt(did), 'refreshJwt': fake_jwt(did)
+                })
+            if self.path == '/xrpc/com.atproto.repo.createRecord':
+                did = self._caller()
+                body = self._body()
+                with pds.account_lock(did):
+                    time.sleep(pds.interval)
+                    with pds.lock:
+                        pds.records.append((did, body['record']['uri']))
+                        n = len(pds.records)
+                return self._send(200, {
+                    'uri': f"at://{did}/{body['collection']}/3k{n:010d}",
+                    'cid': 'bafyreie5737gdxlw5i64vzichcalba3z2v5n6icifvx5xytvske7mr3hpm'
+                })
+            self._send(404, {'error': 'MethodNotImplemented'})
+
+    return Handler
+
+
+def run(n_accounts, writes, threads, rate):
+    pds = FakePDS(rate)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(pds))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/xrpc"
+
+    # Estado de cota/saúde novo a cada rodada (as contas têm os mesmos handles)
+    state = WriterState(os.path.join(tempfile.mkdtemp(prefix='bench-writers-'), 'writers.db'))
+    pool = WriterPool([
+        WriterAccount(f"writer{i}.test", 'password', pds=url, quota_per_hour=writes * 2, state=state)
+        for i in range(n_accounts)
+    ])
+    for account in pool.accounts:
+        account.client()  # login fora da medição
+
+    def write(i):
+        subject = f"did:plc:subject{i % 500}"
+        with pool.session_for(subject) as c:
+            c.com.atproto.repo.create_record(data={
+                'repo': c.me.did,
+                'collection': 'com.atproto.label.defs',
+                'record': {'src': 'did:plc:labeler', 'uri': subject, 'val': 'bench', 'cts': '2024-01-01T00:00:00Z', 'ver': 1}
+            })
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(write, range(writes)))
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    owners = {}
+    for account_did, subject in pds.records:
+        owners.setdefault(subject, set()).add(account_did)
+    split = sum(1 for accounts in owners.values() if len(accounts) > 1)
+    per_account = {}
+    for account_did, _ in pds.records:
+        per_account[account_did] = per_account.get(account_did, 0) + 1
+    return writes / elapsed, split, sorted(per_account.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--writes', type=int, default=600)
+    parser.add_argument('--rate', type=float, default=50, help="escritas/s por conta no PDS falso")
+    parser.add_argument('--accounts', default='1,2,4')
+    parser.add_argument('--threads', type=int, default=32)
+    args = parser.parse_args()
+
+    print(f"\n✍️  WRITER POOL BENCHMARK ({args.writes} escritas, PDS falso a {args.rate:.0f}/s por conta)")
+    baseline = None
+    for n in [int(x) for x in args.accounts.split(',')]:
+        throughput, split, distribution = run(n, args.writes, args.threads, args.rate)
+        baseline = baseline or throughput
+        print(f"   {n} conta(s): {throughput:7.1f} escritas/s | {throughput / baseline:4.2f}x | "
+              f"distribuição {distribution} | DIDs em >1 conta: {split}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+// Throughput of the bulk sync path vs. one `/api/sync-label`-style write per item,
+// against a throwaway SQLite database. Usage: npm run bench-sync [items] [dids]
+import { randomBytes } from 'node:crypto';
+import fs from 'node:fs';
+import os from 'node:os';
+import path from 'node:path';
+
+const ITEMS = Number(process.argv[2] ?? 20000);
+const DIDS = Number(process.argv[3] ?? 5000);
+
+const dir = fs.mkdtempSync(path.join(os.tmpdir(), 'bench-sync-'));
+process.env.DB_PATH = path.join(dir, 'labels.db');
+process.env.DID ??= 'did:plc:benchlabeler';
+process.env.SIGNING_KEY ??= randomBytes(32).toString('hex');
+process.env.LOG_LEVEL = 'warn';
+
+const { LABELS } = await import('./constants.js');
+const { addLabel, negateLabels } = await import('./label.js');
+const { applySyncItems } = await import('./sync.js');
+
+function makeItems(prefix: string) {
+  return Array.from({ length: ITEMS }, (_, i) => ({
+    did: `did:plc:${prefix}${i % DIDS}`,
+    label: LABELS[i % LABELS.length]!.identifier,
+    action: i % 5 === 4 ? 'remove' : 'add',
+  }));
+}
+
+function report(name: string, ms: number) {
+  console.log(`${name.padEnd(10)} ${ITEMS} items in ${ms.toFixed(0)}ms (${((ITEMS / ms) * 1000).toFixed(0)} items/s)`);
+}
+
+const single = makeItems('single');
+let start = performance.now();
+for (const item of single) {
+  if (item.action === 'add') addLabel(item.did, item.label);
+  else negateLabels(item.did, [item.label]);
+}
+report('per-item', performance.now() - start);
+
+const bulk = makeItems('bulk');
+start = performance.now();
+await applySyncItems(bulk);
+report('bulk', performance.now() - start);
+
+fs.rmSync(dir, { recursive: true, force: true });
+process.exit(0);
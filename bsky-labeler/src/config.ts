@@ -7,8 +7,15 @@ export const PORT = process.env.PORT ? Number(process.env.PORT) : 4100;
 export const METRICS_PORT = process.env.METRICS_PORT ? Number(process.env.METRICS_PORT) : 4101;
 export const FIREHOSE_URL = process.env.FIREHOSE_URL ?? 'wss://jetstream.atproto.tools/subscribe';
 export const WANTED_COLLECTION = 'app.bsky.feed.like';
+export const FIREHOSE_COMPRESS = process.env.FIREHOSE_COMPRESS !== 'false';
+export const ZSTD_DICTIONARY_PATH = process.env.ZSTD_DICTIONARY_PATH ?? 'zstd_dictionary';
 export const BSKY_IDENTIFIER = process.env.BSKY_IDENTIFIER ?? '';
 export const BSKY_PASSWORD = process.env.BSKY_PASSWORD ?? '';
 export const CURSOR_UPDATE_INTERVAL =
   process.env.CURSOR_UPDATE_INTERVAL ? Number(process.env.CURSOR_UPDATE_INTERVAL) : 60000;
+export const BATCH_WINDOW_MS = process.env.BATCH_WINDOW_MS ? Number(process.env.BATCH_WINDOW_MS) : 250;
+export const BATCH_MAX_SIZE = process.env.BATCH_MAX_SIZE ? Number(process.env.BATCH_MAX_SIZE) : 500;
 export const SYNC_API_KEY = process.env.SYNC_API_KEY ?? 'secret';
+export const SYNC_BATCH_SIZE = process.env.SYNC_BATCH_SIZE ? Number(process.env.SYNC_BATCH_SIZE) : 500;
+export const SYNC_BODY_LIMIT = process.env.SYNC_BODY_LIMIT ? Number(process.env.SYNC_BODY_LIMIT) : 50 * 1024 * 1024;
+export const DB_PATH = process.env.DB_PATH ?? 'labels.db';
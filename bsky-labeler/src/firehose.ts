@@ -0,0 +1,208 @@
+import { type CommitCreateEvent } from '@skyware/jetstream';
+import { EventEmitter } from 'node:events';
+import fs from 'node:fs';
+import zlib from 'node:zlib';
+
+import { DID, FIREHOSE_COMPRESS, WANTED_COLLECTION, ZSTD_DICTIONARY_PATH } from './config.js';
+import logger from './logger.js';
+import { bytesDecoded, bytesReceived, frameDuration, framesReceived, framesSkipped, recordEventTime } from './metrics.js';
+
+export type LikeEvent = CommitCreateEvent<typeof WANTED_COLLECTION>;
+
+type ZstdCodec = (buffer: Buffer, options?: { dictionary?: Buffer }) => Buffer;
+
+// zlib's zstd functions only exist on recent Node releases and aren't in our @types/node yet
+const { zstdCompressSync, zstdDecompressSync } = zlib as unknown as {
+  zstdCompressSync?: ZstdCodec;
+  zstdDecompressSync?: ZstdCodec;
+};
+
+const RECONNECT_DELAY_MS = 1000;
+const MAX_RECONNECT_DELAY_MS = 30000;
+const STATS_INTERVAL_MS = 60000;
+const TIME_US_PATTERN = /"time_us":(\d+)/;
+
+const PROBE_FRAME = Buffer.from(
+  JSON.stringify({
+    did: DID,
+    time_us: 0,
+    kind: 'commit',
+    commit: { operation: 'create', collection: WANTED_COLLECTION, record: { subject: { uri: `at://${DID}` } } },
+  }),
+);
+
+/**
+ * True if this Node.js release really uses the `dictionary` option: a sample compressed with the
+ * dictionary must fail to decode without it and round-trip with it. Some releases ship zstd but
+ * silently ignore the option, which would make every compressed Jetstream frame undecodable.
+ */
+function supportsDictionary(dictionary: Buffer) {
+  if (!zstdCompressSync || !zstdDecompressSync) return false;
+  try {
+    const sample = zstdCompressSync(PROBE_FRAME, { dictionary });
+    try {
+      zstdDecompressSync(sample);
+      return false;
+    } catch {
+      // Expected: the frame references the dictionary
+    }
+    return zstdDecompressSync(sample, { dictionary }).equals(PROBE_FRAME);
+  } catch {
+    return false;
+  }
+}
+
+function loadDictionary() {
+  if (!FIREHOSE_COMPRESS) return undefined;
+  if (!zstdDecompressSync) {
+    logger.warn('zstd is not available in this Node.js version, using uncompressed Jetstream');
+    return undefined;
+  }
+  let dictionary: Buffer;
+  try {
+    dictionary = fs.readFileSync(ZSTD_DICTIONARY_PATH);
+  } catch (error) {
+    logger.warn(`Could not read zstd dictionary at ${ZSTD_DICTIONARY_PATH}, using uncompressed Jetstream: ${error}`);
+    return undefined;
+  }
+  if (!supportsDictionary(dictionary)) {
+    logger.warn('zstd in this Node.js version does not honor dictionaries, using uncompressed Jetstream');
+    return undefined;
+  }
+  return dictionary;
+}
+
+/**
+ * Minimal Jetstream client for likes on our posts.
+ *
+ * Frames are checked for the labeler DID with a byte search before JSON.parse, so the
+ * overwhelming majority of the network's likes are dropped without being parsed. Only the
+ * `time_us` is pulled out of skipped frames (regex on the frame head) to keep the cursor moving.
+ * With `FIREHOSE_COMPRESS`, frames arrive zstd-compressed with Jetstream's dictionary.
+ */
+export class Firehose extends EventEmitter<{
+  open: [];
+  close: [];
+  error: [Error];
+  like: [LikeEvent];
+}> {
+  cursor?: number;
+
+  private socket?: WebSocket;
+  private closing = false;
+  private reconnectDelay = RECONNECT_DELAY_MS;
+  private readonly dictionary = loadDictionary();
+  private readonly needle = Buffer.from(DID);
+  private statsInterval?: NodeJS.Timeout;
+  private stats = { frames: 0, skipped: 0, wireBytes: 0, decodedBytes: 0, skipNs: 0n, parseNs: 0n };
+
+  constructor(
+    private readonly endpoint: string,
+    cursor?: number,
+  ) {
+    super();
+    this.cursor = cursor;
+    // Until the first frame arrives, the lag is measured from the cursor we resume from
+    if (cursor) recordEventTime(cursor);
+  }
+
+  get compressed() {
+    return this.dictionary !== undefined;
+  }
+
+  start() {
+    this.closing = false;
+    const url = new URL(this.endpoint);
+    url.searchParams.set('wantedCollections', WANTED_COLLECTION);
+    if (this.cursor) url.searchParams.set('cursor', this.cursor.toString());
+    if (this.compressed) url.searchParams.set('compress', 'true');
+
+    const socket = new WebSocket(url);
+    socket.binaryType = 'arraybuffer';
+    socket.addEventListener('open', () => {
+      this.reconnectDelay = RECONNECT_DELAY_MS;
+      this.statsInterval ??= setInterval(() => {
+        this.logStats();
+      }, STATS_INTERVAL_MS);
+      this.emit('open');
+    });
+    socket.addEventListener('message', (message: MessageEvent<ArrayBuffer | string>) => {
+      try {
+        this.handleFrame(message.data);
+      } catch (error) {
+        this.emit('error', error instanceof Error ? error : new Error(String(error)));
+      }
+    });
+    socket.addEventListener('error', () => {
+      this.emit('error', new Error(`WebSocket error on ${url.host}`));
+    });
+    socket.addEventListener('close', () => {
+      this.emit('close');
+      if (this.closing) return;
+      setTimeout(() => {
+        this.start();
+      }, this.reconnectDelay);
+      this.reconnectDelay = Math.min(this.reconnectDelay * 2, MAX_RECONNECT_DELAY_MS);
+    });
+    this.socket = socket;
+  }
+
+  close() {
+    this.closing = true;
+    clearInterval(this.statsInterval);
+    this.statsInterval = undefined;
+    this.socket?.close();
+  }
+
+  private handleFrame(data: ArrayBuffer | string) {
+    const started = process.hrtime.bigint();
+    const raw = typeof data === 'string' ? Buffer.from(data, 'utf8') : Buffer.from(data);
+    const frame = this.compressed ? zstdDecompressSync!(raw, { dictionary: this.dictionary }) : raw;
+
+    this.stats.frames++;
+    this.stats.wireBytes += raw.length;
+    this.stats.decodedBytes += frame.length;
+    bytesReceived.inc(raw.length);
+    bytesDecoded.inc(frame.length);
+
+    framesReceived.inc();
+    const timeUs = TIME_US_PATTERN.exec(frame.toString('latin1', 0, 256))?.[1];
+    if (timeUs) {
+      this.cursor = Number(timeUs);
+      recordEventTime(this.cursor);
+    }
+
+    if (!frame.includes(this.needle)) {
+      const elapsed = process.hrtime.bigint() - started;
+      this.stats.skipped++;
+      this.stats.skipNs += elapsed;
+      framesSkipped.inc();
+      frameDuration.observe({ path: 'skipped' }, Number(elapsed) / 1e9);
+      return;
+    }
+
+    const event = JSON.parse(frame.toString('utf8')) as Partial<LikeEvent>;
+    const elapsed = process.hrtime.bigint() - started;
+    this.stats.parseNs += elapsed;
+    frameDuration.observe({ path: 'parsed' }, Number(elapsed) / 1e9);
+
+    if (event.kind === 'commit' && event.commit?.operation === 'create' && event.commit.collection === WANTED_COLLECTION) {
+      this.emit('like', event as LikeEvent);
+    }
+  }
+
+  private logStats() {
+    const { frames, skipped, wireBytes, decodedBytes, skipNs, parseNs } = this.stats;
+    if (frames === 0) return;
+    const parsed = frames - skipped;
+    const avgSkipUs = skipped ? Number(skipNs / BigInt(skipped)) / 1000 : 0;
+    const avgParseUs = parsed ? Number(parseNs / BigInt(parsed)) / 1000 : 0;
+    logger.info(
+      `Firehose: ${frames} frames, ${skipped} skipped by pre-filter | ` +
+        `${(wireBytes / frames).toFixed(0)} B/event on the wire vs ${(decodedBytes / frames).toFixed(0)} B decoded ` +
+        `(${((1 - wireBytes / decodedBytes) * 100).toFixed(0)}% saved) | ` +
+        `${avgSkipUs.toFixed(1)}µs/skipped frame vs ${avgParseUs.toFixed(1)}µs/parsed frame`,
+    );
+    this.stats = { frames: 0, skipped: 0, wireBytes: 0, decodedBytes: 0, skipNs: 0n, parseNs: 0n };
+  }
+}
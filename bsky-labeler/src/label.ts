@@ -1,13 +1,176 @@
-import { ComAtprotoLabelDefs } from '@atcute/client/lexicons';
 import { LabelerServer } from '@skyware/labeler';
 
-import { DID, SIGNING_KEY } from './config.js';
+import { DB_PATH, DID, SIGNING_KEY } from './config.js';
 import { DELETE, LABELS, LABEL_LIMIT } from './constants.js';
 import logger from './logger.js';
+import { labelDuration, labelsApplied, timeStatement } from './metrics.js';
 
-export const labelerServer = new LabelerServer({ did: DID, signingKey: SIGNING_KEY });
+export const labelerServer = new LabelerServer({ did: DID, signingKey: SIGNING_KEY, dbPath: DB_PATH });
+
+// Materialized state: one row per (uri, val) currently applied, kept in sync with `labels`
+// in the same transaction, so we never have to replay a DID's whole add/negate history.
+labelerServer.db.exec(`
+  CREATE TABLE IF NOT EXISTS current_labels (
+    uri TEXT NOT NULL,
+    val TEXT NOT NULL,
+    PRIMARY KEY (uri, val)
+  ) WITHOUT ROWID;
+  CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY);
+`);
+
+// v2 rebuilds the table: before v2, labels created through @skyware/labeler's own
+// emitEvent route were not tracked (see the createLabel wrapper below)
+const backfillCurrentLabels = labelerServer.db.transaction(() => {
+  const done = labelerServer.db.prepare(`SELECT 1 FROM migrations WHERE name = 'current_labels_v2'`).get();
+  if (done) return;
+
+  logger.info('Backfilling current_labels from labels history...');
+  labelerServer.db.prepare(`DELETE FROM current_labels`).run();
+  // The latest row for each (uri, val) decides whether the label is applied. One grouped pass over
+  // `labels`: it has no (uri, val) index, so a correlated MAX(id) per row would be quadratic.
+  const { changes } = labelerServer.db
+    .prepare(
+      `INSERT OR IGNORE INTO current_labels (uri, val)
+       SELECT uri, val FROM labels
+       WHERE id IN (SELECT MAX(id) FROM labels GROUP BY uri, val) AND NOT neg`,
+    )
+    .run();
+  labelerServer.db.prepare(`INSERT INTO migrations (name) VALUES ('current_labels_v2')`).run();
+  logger.info(`Backfilled ${changes} current labels`);
+});
+backfillCurrentLabels();
+
+const selectCurrentLabels = labelerServer.db
+  .prepare<[string]>(`SELECT val FROM current_labels WHERE uri = ?`)
+  .pluck();
+const insertCurrentLabel = labelerServer.db.prepare<[string, string]>(
+  `INSERT OR IGNORE INTO current_labels (uri, val) VALUES (?, ?)`,
+);
+const deleteCurrentLabel = labelerServer.db.prepare<[string, string]>(
+  `DELETE FROM current_labels WHERE uri = ? AND val = ?`,
+);
+
+/** A write batch failed after some of its labels had already been sent to subscribeLabels clients. */
+export class BroadcastRollbackError extends Error {
+  constructor(cause: unknown) {
+    super(`Write batch rolled back after its labels were broadcast to subscribers: ${String(cause)}`);
+    this.name = 'BroadcastRollbackError';
+  }
+}
+
+function rollback(statement: string) {
+  try {
+    labelerServer.db.exec(statement);
+  } catch {
+    // SQLite already rolled the transaction back on its own (e.g. after an I/O error)
+  }
+}
+
+/**
+ * Runs one label write in a SAVEPOINT, so it is atomic both on its own and inside `writeBatch`,
+ * and a failure only undoes this write. `createLabel` signs, inserts and then emits the label to
+ * subscribers, so it always goes last: a write that throws has not been broadcast.
+ */
+function labelWrite(fn: () => void) {
+  labelerServer.db.exec('SAVEPOINT label_write');
+  try {
+    fn();
+    labelerServer.db.exec('RELEASE label_write');
+  } catch (error) {
+    rollback('ROLLBACK TO label_write');
+    rollback('RELEASE label_write');
+    throw error;
+  }
+}
+
+/**
+ * Runs `fn` in one transaction that takes the write lock up front (BEGIN IMMEDIATE), so a busy
+ * database fails here, before anything is written or broadcast. Callers must not let label write
+ * errors escape `fn`. If `fn` throws anyway or COMMIT fails, the labels it created were already
+ * emitted but are gone from the database (and their sequence numbers will be handed out again):
+ * that surfaces as a `BroadcastRollbackError`.
+ */
+export function writeBatch(fn: () => void) {
+  labelerServer.db.exec('BEGIN IMMEDIATE');
+  try {
+    fn();
+    labelerServer.db.exec('COMMIT');
+  } catch (error) {
+    rollback('ROLLBACK');
+    throw new BroadcastRollbackError(error);
+  }
+}
+
+type CreateLabelData = Parameters<LabelerServer['createLabel']>[0];
+type LabelSubject = Parameters<LabelerServer['createLabels']>[0];
+type LabelValues = Parameters<LabelerServer['createLabels']>[1];
+
+function trackCurrentLabel(uri: string, val: string, neg?: boolean) {
+  if (neg) deleteCurrentLabel.run(uri, val);
+  else insertCurrentLabel.run(uri, val);
+}
+
+// Every label the server creates goes through these wrappers, including the ones from
+// @skyware/labeler's own tools.ozone.moderation.emitEvent route, so current_labels can't drift.
+// Tracking runs first, in the same savepoint, so the broadcasting call stays last.
+// (Both are wrapped in case createLabels doesn't go through createLabel; tracking is idempotent.)
+const createLabel = labelerServer.createLabel.bind(labelerServer);
+const createLabels = labelerServer.createLabels.bind(labelerServer);
+
+labelerServer.createLabel = (data: CreateLabelData) => {
+  let created!: ReturnType<typeof createLabel>;
+  labelWrite(() => {
+    trackCurrentLabel(data.uri, data.val, data.neg);
+    created = createLabel(data);
+  });
+  return created;
+};
+
+labelerServer.createLabels = (subject: LabelSubject, labels: LabelValues) => {
+  let created!: ReturnType<typeof createLabels>;
+  labelWrite(() => {
+    for (const val of labels.create ?? []) trackCurrentLabel(subject.uri, val);
+    for (const val of labels.negate ?? []) trackCurrentLabel(subject.uri, val, true);
+    created = createLabels(subject, labels);
+  });
+  return created;
+};
+
+const addLabelWrite = (did: string, val: string) => {
+  labelerServer.createLabel({ uri: did, val });
+};
+
+const negateLabelWrite = (did: string, val: string) => {
+  labelerServer.createLabel({ uri: did, val, neg: true });
+};
+
+export const addLabel = (did: string, val: string) => {
+  timeStatement('add_label', () => {
+    addLabelWrite(did, val);
+  });
+  labelsApplied.inc({ identifier: val, action: 'add' });
+};
+
+export const negateLabels = (did: string, vals: string[]) => {
+  timeStatement('negate_labels', () => {
+    // One write per label: a failure part-way keeps the negations that were already broadcast
+    for (const val of vals) {
+      negateLabelWrite(did, val);
+      labelsApplied.inc({ identifier: val, action: 'negate' });
+    }
+  });
+};
 
 export const label = (did: string, rkey: string) => {
+  const end = labelDuration.startTimer();
+  try {
+    processLabel(did, rkey);
+  } finally {
+    end();
+  }
+};
+
+const processLabel = (did: string, rkey: string) => {
   logger.info(`Received rkey: ${rkey} for ${did}`);
 
   if (rkey === 'self') {
@@ -27,16 +190,12 @@ export const label = (did: string, rkey: string) => {
   }
 };
 
-function fetchCurrentLabels(did: string) {
-  const query = labelerServer.db
-    .prepare<string[]>(`SELECT * FROM labels WHERE uri = ?`)
-    .all(did) as ComAtprotoLabelDefs.Label[];
+export function currentLabelsOf(did: string) {
+  return new Set(timeStatement('select_current_labels', () => selectCurrentLabels.all(did) as string[]));
+}
 
-  const labels = query.reduce((set, label) => {
-    if (!label.neg) set.add(label.val);
-    else set.delete(label.val);
-    return set;
-  }, new Set<string>());
+function fetchCurrentLabels(did: string) {
+  const labels = currentLabelsOf(did);
 
   if (labels.size > 0) {
     logger.info(`Current labels: ${Array.from(labels).join(', ')}`);
@@ -53,7 +212,7 @@ function deleteAllLabels(did: string, labels: Set<string>) {
   } else {
     logger.info(`Labels to delete: ${labelsToDelete.join(', ')}`);
     try {
-      labelerServer.createLabels({ uri: did }, { negate: labelsToDelete });
+      negateLabels(did, labelsToDelete);
       logger.info('Successfully deleted all labels');
     } catch (error) {
       logger.error(`Error deleting all labels: ${error}`);
@@ -71,7 +230,7 @@ function addOrUpdateLabel(did: string, rkey: string, labels: Set<string>) {
 
   if (labels.size >= LABEL_LIMIT) {
     try {
-      labelerServer.createLabels({ uri: did }, { negate: Array.from(labels) });
+      negateLabels(did, Array.from(labels));
       logger.info(`Successfully negated existing labels: ${Array.from(labels).join(', ')}`);
     } catch (error) {
       logger.error(`Error negating existing labels: ${error}`);
@@ -79,7 +238,7 @@ function addOrUpdateLabel(did: string, rkey: string, labels: Set<string>) {
   }
 
   try {
-    labelerServer.createLabel({ uri: did, val: newLabel.identifier });
+    addLabel(did, newLabel.identifier);
     logger.info(`Successfully labeled ${did} with ${newLabel.identifier}`);
   } catch (error) {
     logger.error(`Error adding new label: ${error}`);
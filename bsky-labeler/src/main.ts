@@ -1,13 +1,15 @@
-import { CommitCreateEvent, Jetstream } from '@skyware/jetstream';
 import fs from 'node:fs';
 
-import { CURSOR_UPDATE_INTERVAL, DID, FIREHOSE_URL, HOST, METRICS_PORT, PORT, WANTED_COLLECTION } from './config.js';
-import { label, labelerServer } from './label.js';
+import { CURSOR_UPDATE_INTERVAL, DID, FIREHOSE_URL, HOST, METRICS_PORT, PORT } from './config.js';
+import { Firehose, type LikeEvent } from './firehose.js';
+import { addLabel, labelerServer, negateLabels } from './label.js';
 import logger from './logger.js';
-import { startMetricsServer } from './metrics.js';
+import { eventsMatched, jetstreamReconnects, startMetricsServer } from './metrics.js';
+import { committedCursor, enqueue, flush } from './pipeline.js';
 
 let cursor = 0;
 let cursorUpdateInterval: NodeJS.Timeout;
+let connectionCount = 0;
 
 function epochUsToDateTime(cursor: number): string {
   return new Date(cursor / 1000).toISOString();
@@ -28,20 +30,19 @@ try {
   }
 }
 
-const jetstream = new Jetstream({
-  wantedCollections: [WANTED_COLLECTION],
-  endpoint: FIREHOSE_URL,
-  cursor: cursor,
-});
+const jetstream = new Firehose(FIREHOSE_URL, cursor);
 
 jetstream.on('open', () => {
+  if (connectionCount++ > 0) jetstreamReconnects.inc();
   logger.info(
-    `Connected to Jetstream at ${FIREHOSE_URL} with cursor ${jetstream.cursor} (${epochUsToDateTime(jetstream.cursor!)})`,
+    `Connected to Jetstream at ${FIREHOSE_URL} with cursor ${jetstream.cursor} (${epochUsToDateTime(jetstream.cursor!)})` +
+      (jetstream.compressed ? ' (zstd)' : ''),
   );
   cursorUpdateInterval = setInterval(() => {
     if (jetstream.cursor) {
-      logger.info(`Cursor updated to: ${jetstream.cursor} (${epochUsToDateTime(jetstream.cursor)})`);
-      fs.writeFile('cursor.txt', jetstream.cursor.toString(), (err) => {
+      const safeCursor = committedCursor(jetstream.cursor);
+      logger.info(`Cursor updated to: ${safeCursor} (${epochUsToDateTime(safeCursor)})`);
+      fs.writeFile('cursor.txt', safeCursor.toString(), (err) => {
         if (err) logger.error(err);
       });
     }
@@ -57,17 +58,19 @@ jetstream.on('error', (error) => {
   logger.error(`Jetstream error: ${error.message}`);
 });
 
-jetstream.onCreate(WANTED_COLLECTION, (event: CommitCreateEvent<typeof WANTED_COLLECTION>) => {
+jetstream.on('like', (event: LikeEvent) => {
   // eslint-disable-next-line @typescript-eslint/no-unnecessary-condition
   if (event.commit?.record?.subject?.uri?.includes(DID)) {
-    label(event.did, event.commit.record.subject.uri.split('/').pop()!);
+    eventsMatched.inc();
+    enqueue(event.did, event.commit.record.subject.uri.split('/').pop()!, event.time_us);
   }
 });
 
 const metricsServer = startMetricsServer(METRICS_PORT);
 
 import express, { type Request, type Response } from 'express';
-import { SYNC_API_KEY } from './config.js';
+import { SYNC_API_KEY, SYNC_BODY_LIMIT } from './config.js';
+import { applySyncItems, parseNdjson } from './sync.js';
 
 labelerServer.app.use(express.json());
 
@@ -83,9 +86,9 @@ labelerServer.app.post('/api/sync-label', async (req: Request, res: Response) =>
     if (action === 'add') {
       // Negate existing labels logic (optional, if we want exclusive badges)
       // For now, simple add
-      labelerServer.createLabel({ uri: did, val: label });
+      addLabel(did, label);
     } else if (action === 'remove') {
-      labelerServer.createLabels({ uri: did }, { negate: [label] });
+      negateLabels(did, [label]);
     }
     return res.json({ success: true });
   } catch (err) {
@@ -94,6 +97,40 @@ labelerServer.app.post('/api/sync-label', async (req: Request, res: Response) =>
   }
 });
 
+// Bulk variant: JSON `{ apiKey, items: [{ did, label, action }, ...] }`
+// or NDJSON (`Content-Type: application/x-ndjson`, one item per line, key in `x-api-key`)
+labelerServer.app.addContentTypeParser('application/x-ndjson', { parseAs: 'string' }, (_req, body, done) => {
+  done(null, body);
+});
+
+labelerServer.app.post<{ Body: unknown; Headers: { 'x-api-key'?: string } }>(
+  '/api/sync-labels',
+  { bodyLimit: SYNC_BODY_LIMIT },
+  async (req, reply) => {
+    const body = req.body;
+    const json = typeof body === 'object' && body !== null ? (body as { apiKey?: unknown; items?: unknown }) : {};
+    const apiKey = req.headers['x-api-key'] ?? json.apiKey;
+    if (!apiKey || apiKey !== SYNC_API_KEY) {
+      return reply.status(401).send({ error: 'Unauthorized' });
+    }
+
+    const items = typeof body === 'string' ? parseNdjson(body) : json.items;
+    if (!Array.isArray(items)) {
+      return reply.status(400).send({ error: 'Expected an `items` array or an NDJSON body' });
+    }
+
+    try {
+      const results = await applySyncItems(items);
+      const summary = { applied: 0, unchanged: 0, invalid: 0, error: 0 };
+      for (const result of results) summary[result.status]++;
+      return reply.send({ success: summary.error === 0, summary, results });
+    } catch (err) {
+      logger.error(`Bulk sync error: ${err}`);
+      return reply.status(500).send({ error: String(err) });
+    }
+  },
+);
+
 labelerServer.app.listen({ port: PORT, host: HOST }, (error, address) => {
   if (error) {
     logger.error('Error starting server: %s', error);
@@ -107,7 +144,8 @@ jetstream.start();
 function shutdown() {
   try {
     logger.info('Shutting down gracefully...');
-    fs.writeFileSync('cursor.txt', jetstream.cursor!.toString(), 'utf8');
+    flush();
+    fs.writeFileSync('cursor.txt', committedCursor(jetstream.cursor!).toString(), 'utf8');
     jetstream.close();
     labelerServer.stop();
     metricsServer.close();
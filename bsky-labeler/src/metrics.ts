@@ -1,11 +1,103 @@
 import express from 'express';
-import { Registry, collectDefaultMetrics } from 'prom-client';
+import { Counter, Gauge, Histogram, Registry, collectDefaultMetrics } from 'prom-client';
 
 import logger from './logger.js';
 
 const register = new Registry();
 collectDefaultMetrics({ register });
 
+let lastEventUs: number | undefined;
+
+/** Records the `time_us` of the latest Jetstream event; the lag gauge is computed from it at scrape time. */
+export function recordEventTime(timeUs: number) {
+  lastEventUs = timeUs;
+}
+
+export const jetstreamLag = new Gauge({
+  name: 'jetstream_cursor_lag_seconds',
+  help: 'Now minus the time of the last Jetstream event received',
+  registers: [register],
+  // Computed on every scrape, so the lag keeps growing while the socket is down or stuck
+  collect() {
+    if (lastEventUs !== undefined) this.set((Date.now() * 1000 - lastEventUs) / 1e6);
+  },
+});
+
+export const framesReceived = new Counter({
+  name: 'jetstream_frames_received_total',
+  help: 'Jetstream frames received (like commits plus identity and account events)',
+  registers: [register],
+});
+
+export const eventsMatched = new Counter({
+  name: 'jetstream_events_matched_total',
+  help: 'Like events whose subject belongs to the labeler DID',
+  registers: [register],
+});
+
+export const bytesReceived = new Counter({
+  name: 'jetstream_bytes_received_total',
+  help: 'Jetstream bytes received on the wire (compressed when zstd is enabled)',
+  registers: [register],
+});
+
+export const bytesDecoded = new Counter({
+  name: 'jetstream_bytes_decoded_total',
+  help: 'Jetstream bytes after decompression',
+  registers: [register],
+});
+
+export const framesSkipped = new Counter({
+  name: 'jetstream_frames_skipped_total',
+  help: 'Frames dropped by the DID pre-filter without JSON parsing',
+  registers: [register],
+});
+
+export const frameDuration = new Histogram({
+  name: 'jetstream_frame_processing_seconds',
+  help: 'Time to decode and filter a Jetstream frame, by path (skipped / parsed)',
+  labelNames: ['path'] as const,
+  buckets: [0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001],
+  registers: [register],
+});
+
+export const jetstreamReconnects = new Counter({
+  name: 'jetstream_reconnects_total',
+  help: 'Jetstream connections opened after the first one',
+  registers: [register],
+});
+
+export const labelsApplied = new Counter({
+  name: 'labels_applied_total',
+  help: 'Labels added or negated, per identifier',
+  labelNames: ['identifier', 'action'] as const,
+  registers: [register],
+});
+
+export const labelDuration = new Histogram({
+  name: 'label_processing_seconds',
+  help: 'Time spent in label() per event',
+  buckets: [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25],
+  registers: [register],
+});
+
+export const sqliteDuration = new Histogram({
+  name: 'sqlite_statement_seconds',
+  help: 'SQLite statement / transaction latency',
+  labelNames: ['statement'] as const,
+  buckets: [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.25],
+  registers: [register],
+});
+
+export function timeStatement<T>(statement: string, fn: () => T): T {
+  const end = sqliteDuration.startTimer({ statement });
+  try {
+    return fn();
+  } finally {
+    end();
+  }
+}
+
 const app = express();
 
 app.get('/metrics', (req, res) => {
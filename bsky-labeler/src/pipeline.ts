@@ -0,0 +1,79 @@
+import { BATCH_MAX_SIZE, BATCH_WINDOW_MS } from './config.js';
+import { BroadcastRollbackError, label, writeBatch } from './label.js';
+import logger from './logger.js';
+import { timeStatement } from './metrics.js';
+
+interface PendingLike {
+  rkey: string;
+  timeUs: number;
+}
+
+// Latest like per DID; re-inserting moves the DID to the end so batch order follows the last like
+const buffer = new Map<string, PendingLike>();
+let oldestPendingUs: number | undefined;
+let flushTimer: NodeJS.Timeout | undefined;
+
+// label() logs and swallows its own errors, so a failing DID never rolls back the rest of the batch
+const applyBatch = (entries: [string, PendingLike][]) => {
+  writeBatch(() => {
+    for (const [did, { rkey }] of entries) {
+      label(did, rkey);
+    }
+  });
+};
+
+export function flush() {
+  if (flushTimer) {
+    clearTimeout(flushTimer);
+    flushTimer = undefined;
+  }
+  if (buffer.size === 0) return;
+
+  const entries = Array.from(buffer);
+  buffer.clear();
+
+  try {
+    timeStatement('apply_batch', () => {
+      applyBatch(entries);
+    });
+    logger.debug(`Applied batch of ${entries.length} label events`);
+  } catch (error) {
+    if (error instanceof BroadcastRollbackError) {
+      // Subscribers may already hold labels from this batch that are not in the database.
+      // Retrying here would reuse their sequence numbers, so stop: cursor.txt is still before
+      // the batch and a restart replays it.
+      logger.fatal(`${error.message} (${entries.length} events), exiting`);
+      process.exit(1);
+    }
+    // The write lock could not be taken, so nothing was written or broadcast: put the events back
+    // (unless a newer like replaced them) and keep oldestPendingUs so the persisted cursor stays
+    // before the failed batch
+    logger.error(`Error applying label batch, retrying: ${error}`);
+    for (const [did, pending] of entries) {
+      if (!buffer.has(did)) buffer.set(did, pending);
+    }
+    flushTimer = setTimeout(flush, BATCH_WINDOW_MS);
+    return;
+  }
+  oldestPendingUs = undefined;
+}
+
+export function enqueue(did: string, rkey: string, timeUs: number) {
+  oldestPendingUs ??= timeUs;
+  buffer.delete(did);
+  buffer.set(did, { rkey, timeUs });
+
+  if (buffer.size >= BATCH_MAX_SIZE) {
+    flush();
+  } else {
+    flushTimer ??= setTimeout(flush, BATCH_WINDOW_MS);
+  }
+}
+
+/**
+ * Cursor that is safe to persist: everything before it has been committed to SQLite.
+ * While events are still buffered, stay just before the oldest one so a restart replays it.
+ */
+export function committedCursor(latestSeenUs: number) {
+  return oldestPendingUs === undefined ? latestSeenUs : Math.min(latestSeenUs, oldestPendingUs - 1);
+}
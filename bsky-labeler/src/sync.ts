@@ -0,0 +1,157 @@
+import { setImmediate } from 'node:timers/promises';
+
+import { SYNC_BATCH_SIZE } from './config.js';
+import { LABELS, LABEL_LIMIT } from './constants.js';
+import { BroadcastRollbackError, addLabel, currentLabelsOf, negateLabels, writeBatch } from './label.js';
+import logger from './logger.js';
+
+const LABEL_IDENTIFIERS = new Set(LABELS.map((label) => label.identifier));
+
+export interface SyncItem {
+  did: string;
+  label: string;
+  action: 'add' | 'remove';
+}
+
+export interface SyncResult {
+  did?: unknown;
+  label?: unknown;
+  action?: unknown;
+  status: 'applied' | 'unchanged' | 'invalid' | 'error';
+  error?: string;
+}
+
+function validate(item: unknown): string | undefined {
+  if (typeof item !== 'object' || item === null) return 'Item must be an object';
+  const { did, label, action } = item as Record<string, unknown>;
+  if (typeof did !== 'string' || !did.startsWith('did:')) return 'Invalid DID';
+  if (typeof label !== 'string' || !LABEL_IDENTIFIERS.has(label)) return `Unknown label: ${String(label)}`;
+  if (action !== 'add' && action !== 'remove') return `Invalid action: ${String(action)}`;
+  return undefined;
+}
+
+/** Parses an NDJSON body; unparseable lines are kept as-is so they come back as `invalid` results. */
+export function parseNdjson(body: string): unknown[] {
+  return body
+    .split('\n')
+    .filter((line) => line.trim() !== '')
+    .map((line) => {
+      try {
+        return JSON.parse(line) as unknown;
+      } catch {
+        return line;
+      }
+    });
+}
+
+/**
+ * Applies `item`s in order for one DID on an in-memory copy of its labels,
+ * with the same LABEL_LIMIT exclusivity as likes: adding past the limit evicts the current labels.
+ */
+function resolve(current: Set<string>, items: SyncItem[], results: SyncResult[], indexes: number[]) {
+  const next = new Set(current);
+  items.forEach((item, i) => {
+    let changed = false;
+    if (item.action === 'add' && !next.has(item.label)) {
+      if (next.size >= LABEL_LIMIT) next.clear();
+      next.add(item.label);
+      changed = true;
+    } else if (item.action === 'remove' && next.has(item.label)) {
+      next.delete(item.label);
+      changed = true;
+    }
+    results[indexes[i]!] = { ...item, status: changed ? 'applied' : 'unchanged' };
+  });
+  return next;
+}
+
+/**
+ * Writes the net change of each DID in `chunk` in one transaction. A DID that fails is reported
+ * on its own and the rest of the chunk still commits. Returns the DIDs that failed, with the error.
+ */
+function applyChunk(chunk: [string, Set<string>, Set<string>][]) {
+  const failed = new Map<string, string>();
+  writeBatch(() => {
+    for (const [did, current, next] of chunk) {
+      const toNegate = Array.from(current).filter((val) => !next.has(val));
+      const toAdd = Array.from(next).filter((val) => !current.has(val));
+      try {
+        if (toNegate.length > 0) negateLabels(did, toNegate);
+        for (const val of toAdd) addLabel(did, val);
+      } catch (error) {
+        // Only the failing label write was undone; this DID's earlier writes stay (and were broadcast)
+        failed.set(did, `${String(error)} (writes for this DID before the failure were kept)`);
+      }
+    }
+  });
+  return failed;
+}
+
+/**
+ * Bulk counterpart of `/api/sync-label`: validates every item, works out the net change per DID
+ * and writes only that, SYNC_BATCH_SIZE DIDs per transaction, yielding to the event loop between
+ * transactions so a large resync doesn't stall Jetstream. Results are returned in input order.
+ */
+export async function applySyncItems(items: unknown[]): Promise<SyncResult[]> {
+  const results: SyncResult[] = new Array<SyncResult>(items.length);
+  const byDid = new Map<string, { items: SyncItem[]; indexes: number[] }>();
+
+  items.forEach((item, index) => {
+    const error = validate(item);
+    if (error) {
+      const { did, label, action } = (typeof item === 'object' && item !== null ? item : {}) as Record<string, unknown>;
+      results[index] = { did, label, action, status: 'invalid', error };
+      return;
+    }
+    const valid = item as SyncItem;
+    let group = byDid.get(valid.did);
+    if (!group) {
+      group = { items: [], indexes: [] };
+      byDid.set(valid.did, group);
+    }
+    group.items.push({ did: valid.did, label: valid.label, action: valid.action });
+    group.indexes.push(index);
+  });
+
+  const dids = Array.from(byDid.keys());
+  let changed = 0;
+  for (let i = 0; i < dids.length; i += SYNC_BATCH_SIZE) {
+    if (i > 0) {
+      // Give Jetstream, the like pipeline and subscribeLabels a turn between chunks
+      await setImmediate();
+    }
+
+    // Current labels are read per chunk, right before writing: likes may have changed them meanwhile
+    const chunk: [string, Set<string>, Set<string>][] = [];
+    for (const did of dids.slice(i, i + SYNC_BATCH_SIZE)) {
+      const group = byDid.get(did)!;
+      const current = currentLabelsOf(did);
+      const next = resolve(current, group.items, results, group.indexes);
+      if (next.size !== current.size || Array.from(next).some((val) => !current.has(val))) {
+        chunk.push([did, current, next]);
+      }
+    }
+    if (chunk.length === 0) continue;
+    changed += chunk.length;
+
+    let failed: Map<string, string>;
+    try {
+      failed = applyChunk(chunk);
+    } catch (error) {
+      // The whole chunk was rolled back; earlier chunks stay committed. After a BroadcastRollbackError
+      // subscribers may already have seen labels from this chunk that are not in the database.
+      logger.error(`Bulk sync chunk failed: ${error}`);
+      const message =
+        error instanceof BroadcastRollbackError ? error.message : `Not applied, chunk could not start: ${String(error)}`;
+      failed = new Map(chunk.map(([did]) => [did, message]));
+    }
+    for (const [did, error] of failed) {
+      for (const index of byDid.get(did)!.indexes) {
+        results[index] = { ...results[index]!, status: 'error', error };
+      }
+    }
+  }
+
+  logger.info(`Bulk sync: ${items.length} items, ${byDid.size} DIDs, ${changed} changed`);
+  return results;
+}
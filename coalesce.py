@@ -0,0 +1,68 @@
+"""
+Single-flight: requisições concorrentes pela mesma chave compartilham UMA execução.
+
+O primeiro thread (leader) executa a função; os demais esperam o resultado.
+Se o leader falhar, todos recebem a mesma exceção. Se a espera passar de
+`timeout`, o follower desiste e executa a função por conta própria.
+"""
+
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {'calls': 0, 'executed': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            self.stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(self.timeout):
+                with self._lock:
+                    self.stats['coalesced'] += 1
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            with self._lock:
+                self.stats['timeouts'] += 1
+            return self._execute(fn)
+
+        try:
+            call.result = self._execute(fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _execute(self, fn):
+        with self._lock:
+            self.stats['executed'] += 1
+        try:
+            return fn()
+        except Exception:
+            with self._lock:
+                self.stats['errors'] += 1
+            raise
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, in_flight=len(self._calls))
@@ -0,0 +1,238 @@
+"""
+Compactação dos records com.atproto.label.defs nos repositórios do Labeler
+
+Cada add/remove via apply_label_via_repo cria um record novo e nunca apaga os antigos.
+Com LABELER_WRITERS as escritas ficam espalhadas pelos repos das contas escritoras
+(e um failover pode pôr o add e o negate de um DID em repos diferentes), então este
+job lista os records de TODAS as contas de writer_pool.load_accounts(), calcula o
+estado efetivo por (uri, val) somando todos os repos — o record mais recente vence —
+e apaga os records superados em lotes de applyWrites, repo por repo.
+
+O plano de deleção e o progresso ficam num checkpoint (JSON): se o job cair,
+rodar de novo continua de onde parou.
+
+Uso:
+    python compact_labels.py --dry-run
+    python compact_labels.py [--batch-size 100] [--interval 2] [--max-deletes 3000]
+    python compact_labels.py --fresh        # descarta o checkpoint e escaneia de novo
+"""
+
+import os
+import json
+import time
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+COLLECTION = 'com.atproto.label.defs'
+CHECKPOINT_FILE = os.getenv('COMPACT_CHECKPOINT', 'compact_checkpoint.json')
+MAX_BATCH = 200  # limite de writes por applyWrites no PDS
+
+
+def _field(value, name):
+    """Records de coleção sem lexicon vêm como dict ou objeto, dependendo do SDK"""
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+def login():
+    from atproto import Client
+
+    handle = os.getenv('BLUESKY_HANDLE', 'labeler.boio.la')
+    password = os.getenv('BLUESKY_PASSWORD')
+    if not password:
+        raise ValueError('BLUESKY_PASSWORD not set')
+
+    print(f"🔐 Fazendo login no Bluesky como: {handle}")
+    client = Client()
+    client.login(handle, password)
+    print(f"✅ Login OK ({client.me.did})")
+    return client
+
+
+def login_writers():
+    """
+    Clients do repo principal (BLUESKY_HANDLE, onde estão os records de antes do
+    sharding) e de todas as contas escritoras: {did do repo: client}
+    """
+    from writer_pool import load_accounts
+
+    main = login()
+    clients = {main.me.did: main}
+    for account in load_accounts(default_client_factory=lambda: main):
+        client = account.client()
+        clients.setdefault(client.me.did, client)
+    return clients
+
+
+def scan_label_records(client):
+    """Lista todos os records de label do repo: [(rkey, uri, val, neg, cts, repo)]"""
+    records = []
+    cursor = None
+    while True:
+        params = {'repo': client.me.did, 'collection': COLLECTION, 'limit': 100}
+        if cursor:
+            params['cursor'] = cursor
+        page = client.com.atproto.repo.list_records(params=params)
+        for rec in page.records:
+            value = rec.value
+            records.append((
+                rec.uri.split('/')[-1],
+                _field(value, 'uri'),
+                _field(value, 'val'),
+                bool(_field(value, 'neg')),
+                _field(value, 'cts') or '',
+                client.me.did
+            ))
+        cursor = page.cursor
+        print(f"   ... {len(records)} records lidos")
+        if not cursor or not page.records:
+            return records
+
+
+def plan_compaction(records):
+    """
+    Estado efetivo por (uri, val), somando todos os repos: o record mais recente
+    (cts, depois rkey/TID). Ele é mantido — inclusive negações, para quem já viu o
+    label positivo — e todo o resto é superado, em qualquer repo que esteja.
+    Retorna to_delete como [[repo, rkey], ...], agrupado por repo.
+    """
+    latest = {}
+    for rec in records:
+        rkey, uri, val, neg, cts, repo = rec
+        key = (uri, val)
+        if key not in latest or (cts, rkey, repo) > (latest[key][4], latest[key][0], latest[key][5]):
+            latest[key] = rec
+
+    keep = {(rec[5], rec[0]) for rec in latest.values()}
+    to_delete = sorted([rec[5], rec[0]] for rec in records if (rec[5], rec[0]) not in keep)
+    active = sum(1 for rec in latest.values() if not rec[3])
+    return {
+        'total_records': len(records),
+        'pairs': len(latest),
+        'active_labels': active,
+        'to_delete': to_delete,
+    }
+
+
+def load_checkpoint():
+    try:
+        with open(CHECKPOINT_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(checkpoint):
+    tmp = CHECKPOINT_FILE + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, CHECKPOINT_FILE)
+
+
+def next_batch(to_delete, start, size):
+    """Até `size` deleções a partir de `start`, todas do mesmo repo (applyWrites é por repo)"""
+    repo = to_delete[start][0]
+    batch = []
+    for entry_repo, rkey in to_delete[start:start + size]:
+        if entry_repo != repo:
+            break
+        batch.append(rkey)
+    return repo, batch
+
+
+def delete_batch(client, rkeys):
+    from atproto import models
+
+    client.com.atproto.repo.apply_writes(
+        models.ComAtprotoRepoApplyWrites.Data(
+            repo=client.me.did,
+            writes=[models.ComAtprotoRepoApplyWrites.Delete(collection=COLLECTION, rkey=rkey) for rkey in rkeys]
+        )
+    )
+
+
+def compact(dry_run=False, batch_size=100, interval=2.0, max_deletes=None, fresh=False):
+    print("\n" + "="*60)
+    print("🧹 COMPACTAÇÃO DE LABELS DO REPO")
+    print("="*60 + "\n")
+
+    clients = login_writers()
+    repos = sorted(clients)
+    checkpoint = None if fresh else load_checkpoint()
+
+    if checkpoint and checkpoint.get('repos') != repos:
+        print(f"⚠️ Checkpoint é de outro conjunto de repos ({checkpoint.get('repos', checkpoint.get('repo'))}), ignorando")
+        checkpoint = None
+
+    if checkpoint and not dry_run:
+        print(f"♻️ Retomando checkpoint: {checkpoint['done']}/{len(checkpoint['to_delete'])} já apagados")
+    else:
+        records = []
+        for repo in repos:
+            print(f"🔍 Escaneando records de {repo}...")
+            records.extend(scan_label_records(clients[repo]))
+        plan = plan_compaction(records)
+        print(f"\n📊 {plan['total_records']} records | {plan['pairs']} pares (uri, val) | {plan['active_labels']} labels ativos")
+        print(f"   Superados (a apagar): {len(plan['to_delete'])}")
+
+        if dry_run:
+            print("\n🧪 DRY RUN: nada foi apagado.")
+            return plan
+
+        checkpoint = {'repos': repos, 'created_at': time.time(), 'to_delete': plan['to_delete'], 'done': 0}
+        save_checkpoint(checkpoint)
+
+    batch_size = max(1, min(batch_size, MAX_BATCH))
+    to_delete = checkpoint['to_delete']
+    deleted_now = 0
+
+    while checkpoint['done'] < len(to_delete):
+        if max_deletes is not None and deleted_now >= max_deletes:
+            print(f"⏸️ Limite de {max_deletes} deleções desta execução atingido. Rode de novo para continuar.")
+            break
+
+        size = batch_size if max_deletes is None else min(batch_size, max_deletes - deleted_now)
+        repo, batch = next_batch(to_delete, checkpoint['done'], size)
+        try:
+            delete_batch(clients[repo], batch)
+        except Exception as e:
+            print(f"❌ Erro no applyWrites (checkpoint salvo em {checkpoint['done']}): {e}")
+            raise
+
+        checkpoint['done'] += len(batch)
+        deleted_now += len(batch)
+        save_checkpoint(checkpoint)
+        print(f"🗑️ {checkpoint['done']}/{len(to_delete)} apagados ({repo})")
+
+        if checkpoint['done'] < len(to_delete):
+            time.sleep(interval)
+
+    if checkpoint['done'] >= len(to_delete):
+        os.remove(CHECKPOINT_FILE)
+        print("\n✅ Compactação completa!")
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apaga records de label superados nos repos do labeler")
+    parser.add_argument('--dry-run', action='store_true', help="só calcula e mostra o plano")
+    parser.add_argument('--batch-size', type=int, default=100, help=f"deleções por applyWrites (máx {MAX_BATCH})")
+    parser.add_argument('--interval', type=float, default=2.0, help="segundos entre lotes (rate limit do PDS)")
+    parser.add_argument('--max-deletes', type=int, help="para depois de N deleções nesta execução")
+    parser.add_argument('--fresh', action='store_true', help="ignora o checkpoint e escaneia de novo")
+    args = parser.parse_args()
+
+    compact(
+        dry_run=args.dry_run,
+        batch_size=args.batch_size,
+        interval=args.interval,
+        max_deletes=args.max_deletes,
+        fresh=args.fresh
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Camada de banco (MySQL Hostgator)
+
+- Escritas e leituras sensíveis vão para o primário (DB_HOST).
+- Leituras (queryLabels, /debug) podem ir para réplicas (DB_READ_HOSTS),
+  em round-robin, desde que o atraso de replicação esteja abaixo de DB_MAX_REPLICA_LAG.
+- Réplica cujo lag não dá para verificar (usuário sem REPLICATION CLIENT, comum em
+  hospedagem compartilhada) conta como atrasada, a não ser com DB_TRUST_UNVERIFIED_LAG=1.
+- Read-your-writes: um DID recém alterado via /apply-badge ou /remove-badge
+  é lido do primário durante DB_STICKY_SECONDS. A marca fica num SQLite em
+  DB_STICKY_PATH, compartilhado por todos os workers do gunicorn.
+"""
+
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+import mysql.connector
+
+MAX_REPLICA_LAG = float(os.getenv('DB_MAX_REPLICA_LAG', 5))
+LAG_CHECK_INTERVAL = float(os.getenv('DB_LAG_CHECK_INTERVAL', 5))
+TRUST_UNVERIFIED_LAG = os.getenv('DB_TRUST_UNVERIFIED_LAG', '0') == '1'
+STICKY_SECONDS = float(os.getenv('DB_STICKY_SECONDS', 30))
+STICKY_PATH = os.getenv('DB_STICKY_PATH', os.path.join(tempfile.gettempdir(), 'diva-recent-writes.db'))
+
+_lock = threading.Lock()
+_next_replica = 0
+_replica_health = {}   # "host:port" -> (checked_at, healthy, lag)
+_local = threading.local()
+
+
+def _parse_host(value):
+    host, _, port = value.strip().partition(':')
+    return host, int(port) if port else 3306
+
+
+def get_replica_hosts():
+    """Lista de réplicas configuradas em DB_READ_HOSTS (host[:porta], separados por vírgula)"""
+    raw = os.getenv('DB_READ_HOSTS', '')
+    return [_parse_host(h) for h in raw.split(',') if h.strip()]
+
+
+def _connect(host, port=3306):
+    return mysql.connector.connect(
+        host=host,
+        port=port,
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=os.getenv('DB_NAME'),
+        connect_timeout=10
+    )
+
+
+def get_db_connection():
+    """Establish database connection (primary / writer)"""
+    try:
+        return _connect(os.getenv('DB_HOST'), int(os.getenv('DB_PORT', 3306)))
+    except Exception as e:
+        print(f"❌ Database connection failed: {e}")
+        raise e
+
+
+def get_replication_lag(conn):
+    """
+    Segundos de atraso da réplica.
+    None = replicação parada/quebrada; -1 = não foi possível verificar (sem privilégio).
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except mysql.connector.Error:
+            cursor.execute("SHOW SLAVE STATUS")
+        row = cursor.fetchone()
+    except mysql.connector.Error as e:
+        print(f"⚠️ Não foi possível checar lag da réplica: {e}")
+        return -1
+    finally:
+        cursor.close()
+
+    if not row:
+        # Não é réplica (ex: apontou para o próprio primário)
+        return 0
+    lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+    return None if lag is None else float(lag)
+
+
+def _replica_is_healthy(key, conn):
+    now = time.time()
+    with _lock:
+        cached = _replica_health.get(key)
+    if cached and now - cached[0] < LAG_CHECK_INTERVAL:
+        return cached[1]
+
+    lag = get_replication_lag(conn)
+    if lag == -1:
+        # Sem como verificar: só confia na réplica se isso foi pedido explicitamente
+        healthy = TRUST_UNVERIFIED_LAG
+    else:
+        healthy = lag is not None and lag <= MAX_REPLICA_LAG
+    with _lock:
+        _replica_health[key] = (now, healthy, lag)
+    if not healthy:
+        reason = 'lag não verificável' if lag == -1 else f'lag: {lag}'
+        print(f"⚠️ Réplica {key} atrasada ({reason}), usando primário")
+    return healthy
+
+
+def _sticky_conn():
+    conn = getattr(_local, 'sticky', None)
+    if conn is None:
+        conn = sqlite3.connect(STICKY_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS recent_writes (
+                did TEXT PRIMARY KEY,
+                written_at REAL NOT NULL
+            )
+        """)
+        _local.sticky = conn
+    return conn
+
+
+def note_write(did):
+    """Marca um DID como recém alterado (leituras seguintes vão ao primário, em qualquer worker)"""
+    now = time.time()
+    try:
+        conn = _sticky_conn()
+        conn.execute("INSERT OR REPLACE INTO recent_writes (did, written_at) VALUES (?, ?)", (did, now))
+        # Limpa entradas expiradas para a tabela não crescer sem limite
+        conn.execute("DELETE FROM recent_writes WHERE written_at < ?", (now - STICKY_SECONDS,))
+    except sqlite3.Error as e:
+        print(f"⚠️ Não foi possível marcar {did} como recém alterado: {e}")
+
+
+def recently_written(dids):
+    """True se algum DID foi alterado há menos de DB_STICKY_SECONDS"""
+    dids = list(dids)
+    if not dids:
+        return False
+    try:
+        placeholders = ','.join('?' * len(dids))
+        row = _sticky_conn().execute(
+            f"SELECT 1 FROM recent_writes WHERE written_at >= ? AND did IN ({placeholders}) LIMIT 1",
+            [time.time() - STICKY_SECONDS, *dids]
+        ).fetchone()
+        return row is not None
+    except sqlite3.Error as e:
+        # Na dúvida, lê do primário
+        print(f"⚠️ Não foi possível checar escritas recentes: {e}")
+        return True
+
+
+def recent_write_dids():
+    """DIDs alterados há menos de DB_STICKY_SECONDS"""
+    try:
+        rows = _sticky_conn().execute(
+            "SELECT did FROM recent_writes WHERE written_at >= ?", (time.time() - STICKY_SECONDS,)
+        ).fetchall()
+        return [row[0] for row in rows]
+    except sqlite3.Error as e:
+        print(f"⚠️ Não foi possível listar escritas recentes: {e}")
+        return []
+
+
+def get_read_connection(dids=()):
+    """
+    Conexão para leitura: réplica saudável (round-robin) ou primário como fallback.
+    `dids` são os sujeitos da leitura, usados para garantir read-your-writes.
+    """
+    global _next_replica
+
+    replicas = get_replica_hosts()
+    if not replicas or recently_written(dids):
+        return get_db_connection()
+
+    with _lock:
+        start = _next_replica
+        _next_replica = (_next_replica + 1) % len(replicas)
+
+    for i in range(len(replicas)):
+        host, port = replicas[(start + i) % len(replicas)]
+        key = f"{host}:{port}"
+
+        with _lock:
+            cached = _replica_health.get(key)
+        if cached and not cached[1] and time.time() - cached[0] < LAG_CHECK_INTERVAL:
+            continue
+
+        try:
+            conn = _connect(host, port)
+        except Exception as e:
+            print(f"⚠️ Réplica {key} indisponível: {e}")
+            with _lock:
+                _replica_health[key] = (time.time(), False, None)
+            continue
+
+        if _replica_is_healthy(key, conn):
+            return conn
+        conn.close()
+
+    return get_db_connection()
+
+
+def get_replica_status():
+    """Snapshot do estado das réplicas (para o /debug)"""
+    with _lock:
+        return {
+            key: {'healthy': healthy, 'lag': lag, 'checked_at': checked_at}
+            for key, (checked_at, healthy, lag) in _replica_health.items()
+        }
+
+
+def reset_after_fork():
+    """Zera o estado por processo (chamado no post_fork do gunicorn)"""
+    global _lock, _next_replica, _local
+    _lock = threading.Lock()
+    _next_replica = 0
+    _local = threading.local()
+    _replica_health.clear()
@@ -0,0 +1,206 @@
+"""
+Resolver de DID Documents (did:plc e did:web)
+
+- Sessão HTTP com pool de conexões e timeouts curtos.
+- Cache TTL + LRU em memória, com cache negativo (DID inexistente/inválido)
+  por menos tempo. Erros de rede NÃO entram no cache.
+- resolve_many() resolve em paralelo só o que não estiver no cache.
+- did:web vem de input não autenticado (/apply-badge): só domínios públicos, sem
+  porta, sem IP literal, sem redirect, e o host tem que resolver só para IPs globais
+  (nada de loopback, link-local ou rede privada).
+"""
+
+import os
+import re
+import time
+import socket
+import ipaddress
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+PLC_DIRECTORY = os.getenv('PLC_DIRECTORY', 'https://plc.directory')
+CACHE_SIZE = int(os.getenv('DID_CACHE_SIZE', 10000))
+CACHE_TTL = float(os.getenv('DID_CACHE_TTL', 3600))
+NEGATIVE_TTL = float(os.getenv('DID_NEGATIVE_TTL', 300))
+TIMEOUT = (2, 5)  # (connect, read) em segundos
+MAX_WORKERS = 8
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # did -> (expires_at, doc | None)
+_session = None
+
+
+class DIDResolutionError(Exception):
+    """Falha transitória (rede/timeout/5xx): não dá para afirmar que o DID não existe"""
+
+
+class InvalidDID(ValueError):
+    """DID que não deve ser resolvido (não é erro transitório, não vai para o cache)"""
+
+
+class UnsupportedDIDMethod(InvalidDID):
+    """Método de DID que o resolver não sabe resolver (só did:plc e did:web)"""
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS * 2, max_retries=1)
+        session.mount('https://', adapter)
+        session.headers['Accept'] = 'application/did+json, application/json'
+        _session = session
+    return _session
+
+
+WEB_HOST_PATTERN = re.compile(r'^(?=.{1,253}$)([a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z][a-z0-9-]{0,61}[a-z0-9]$')
+WEB_SEGMENT_PATTERN = re.compile(r'^[A-Za-z0-9._~-]+$')
+NON_PUBLIC_SUFFIXES = ('.localhost', '.local', '.internal', '.lan', '.home.arpa', '.intranet', '.corp')
+
+
+def _web_parts(did):
+    """(host, segmentos do path) de um did:web; levanta InvalidDID se não for um domínio público"""
+    parts = did[len('did:web:'):].split(':')
+    host = parts[0].lower()
+    # Sem porta (%3A), IP literal ou nome de rede interna: exigimos um domínio público
+    if not WEB_HOST_PATTERN.match(host) or host.endswith(NON_PUBLIC_SUFFIXES):
+        raise InvalidDID(f"did:web host not allowed: {parts[0]}")
+    for segment in parts[1:]:
+        if not WEB_SEGMENT_PATTERN.match(segment) or segment in ('.', '..'):
+            raise InvalidDID(f"Invalid did:web path: {did}")
+    return host, parts[1:]
+
+
+def _check_public_host(host):
+    """Todos os IPs do host precisam ser globais (evita SSRF para a rede interna via DNS)"""
+    try:
+        infos = socket.getaddrinfo(host, 443, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise DIDResolutionError(f"{host}: {e}")
+    for info in infos:
+        ip = ipaddress.ip_address(info[4][0].split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            raise InvalidDID(f"did:web host resolves to a non-public address: {host}")
+
+
+def did_document_url(did):
+    """URL do DID Document, ou None se o método não for suportado"""
+    if did.startswith('did:plc:'):
+        return f"{PLC_DIRECTORY}/{did}"
+    if did.startswith('did:web:'):
+        # did:web:host[:path:segments]
+        host, path = _web_parts(did)
+        if not path:
+            return f"https://{host}/.well-known/did.json"
+        return f"https://{host}/{'/'.join(path)}/did.json"
+    return None
+
+
+def _cache_get(did):
+    with _lock:
+        entry = _cache.get(did)
+        if entry is None:
+            return False, None
+        expires_at, doc = entry
+        if expires_at < time.time():
+            del _cache[did]
+            return False, None
+        _cache.move_to_end(did)
+        return True, doc
+
+
+def _cache_set(did, doc):
+    ttl = CACHE_TTL if doc is not None else NEGATIVE_TTL
+    with _lock:
+        _cache[did] = (time.time() + ttl, doc)
+        _cache.move_to_end(did)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _fetch(did):
+    url = did_document_url(did)
+    if did.startswith('did:web:'):
+        _check_public_host(_web_parts(did)[0])
+    try:
+        # Sem redirect: um 302 para a rede interna contornaria a checagem do host
+        res = _get_session().get(url, timeout=TIMEOUT, allow_redirects=False)
+    except Exception as e:
+        raise DIDResolutionError(f"{did}: {e}")
+    if res.status_code in (404, 410):
+        return None
+    if res.status_code != 200:
+        raise DIDResolutionError(f"{did}: HTTP {res.status_code}")
+    try:
+        doc = res.json()
+    except ValueError:
+        # Página de erro/HTML do upstream: não dá para afirmar que o DID não existe
+        raise DIDResolutionError(f"{did}: response is not JSON")
+    # JSON válido mas que não é um DID Document (lista, string, id de outro DID...)
+    if not isinstance(doc, dict) or doc.get('id') != did:
+        return None
+    return doc
+
+
+def resolve(did):
+    """
+    DID Document (dict) ou None se não existe. Levanta DIDResolutionError em falha
+    transitória, UnsupportedDIDMethod para métodos além de did:plc e did:web e
+    InvalidDID para did:web que não aponta para um domínio público.
+    """
+    if did_document_url(did) is None:
+        raise UnsupportedDIDMethod(f"Unsupported DID method: {did.split(':')[1] if did.count(':') >= 2 else did}")
+    hit, doc = _cache_get(did)
+    if hit:
+        return doc
+    doc = _fetch(did)
+    _cache_set(did, doc)
+    return doc
+
+
+def resolve_many(dids):
+    """{did: doc | None | DIDResolutionError | InvalidDID} — só os misses vão para a rede, em paralelo"""
+    results = {}
+    misses = []
+    for did in dict.fromkeys(dids):
+        hit, doc = _cache_get(did)
+        if hit:
+            results[did] = doc
+        else:
+            misses.append(did)
+
+    if misses:
+        def safe_resolve(did):
+            try:
+                return resolve(did)
+            except (DIDResolutionError, InvalidDID) as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(misses))) as pool:
+            for did, doc in zip(misses, pool.map(safe_resolve, misses)):
+                results[did] = doc
+    return results
+
+
+def get_handle(doc):
+    """Handle declarado no alsoKnownAs (at://handle)"""
+    for aka in (doc or {}).get('alsoKnownAs') or []:
+        if isinstance(aka, str) and aka.startswith('at://'):
+            return aka[len('at://'):]
+    return None
+
+
+def cache_stats():
+    with _lock:
+        return {'size': len(_cache), 'max_size': CACHE_SIZE}
+
+
+def reset_after_fork():
+    """Sockets do pool não podem ser compartilhados entre processos"""
+    global _session, _lock
+    _session = None
+    _lock = threading.Lock()
@@ -0,0 +1,136 @@
+"""
+Export de TODOS os labels atuais em NDJSON (memória constante)
+
+Cada linha: {"did", "label_id", "cts", "neg", "cid", "rkey", "cursor"}.
+Leitura com cursor NÃO bufferizado, paginada por keyset (user_badges.id),
+então dá para retomar de onde parou com --after <cursor>.
+
+Uso:
+    python export_labels.py > labels.ndjson
+    python export_labels.py --after 123456 >> labels.ndjson
+    python export_labels.py --url https://labeler.exemplo --token $ADMIN_TOKEN > labels.ndjson
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+PAGE_SIZE = 10000
+FETCH_SIZE = 1000
+
+EXPORT_QUERY = """
+    SELECT ub.id, ubp.bluesky_did, bb.label_id, ub.created_at, ub.cid, ub.rkey
+    FROM user_badges ub
+    JOIN bluesky_badges bb ON bb.id = ub.badge_id
+    JOIN user_bluesky_profiles ubp ON ubp.user_id = ub.user_id
+    WHERE ub.id > %s
+    ORDER BY ub.id
+    LIMIT %s
+"""
+
+
+def iter_labels(conn, after=0, max_rows=None, deadline=None):
+    """
+    Gera dicts de label a partir de `after` (exclusivo), página por página.
+    Para em `max_rows` linhas ou quando passar de `deadline` (time.monotonic()).
+    Retorna (último cursor lido, terminou?) via StopIteration.value.
+    """
+    from label_store import format_cts
+
+    sent = 0
+    while True:
+        page = PAGE_SIZE if max_rows is None else min(PAGE_SIZE, max_rows - sent)
+        if page <= 0:
+            return after, False
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(EXPORT_QUERY, (after, page))
+        rows_in_page = 0
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for ub_id, did, label_id, created_at, cid, rkey in rows:
+                rows_in_page += 1
+                after = ub_id
+                if not did or not label_id:
+                    continue
+                sent += 1
+                yield {
+                    "did": did,
+                    "label_id": label_id,
+                    "cts": format_cts(created_at),
+                    "neg": False,
+                    "cid": cid,
+                    "rkey": rkey,
+                    "cursor": ub_id
+                }
+        cursor.close()
+
+        if rows_in_page < page:
+            return after, True
+        if deadline is not None and time.monotonic() >= deadline:
+            return after, False
+
+
+def export_from_db(out, after):
+    from db import get_read_connection
+
+    conn = get_read_connection()
+    total = 0
+    try:
+        for label in iter_labels(conn, after=after):
+            out.write(json.dumps(label) + "\n")
+            total += 1
+    finally:
+        conn.close()
+    return total
+
+
+def export_from_api(out, after, url, token):
+    import requests
+
+    session = requests.Session()
+    session.headers['X-Admin-Token'] = token or ''
+    total = 0
+    while True:
+        res = session.get(f"{url.rstrip('/')}/admin/export-labels", params={'after': after}, stream=True, timeout=60)
+        res.raise_for_status()
+        next_cursor = None
+        for line in res.iter_lines():
+            if not line:
+                continue
+            item = json.loads(line)
+            if 'next_cursor' in item:
+                next_cursor = item['next_cursor']
+                continue
+            out.write(json.dumps(item) + "\n")
+            after = item['cursor']
+            total += 1
+        if next_cursor is None:
+            return total
+        after = next_cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta todos os labels atuais em NDJSON")
+    parser.add_argument('--after', type=int, default=0, help="cursor (user_badges.id) para retomar")
+    parser.add_argument('--url', help="puxa do endpoint /admin/export-labels em vez do MySQL")
+    parser.add_argument('--token', default=os.getenv('ADMIN_TOKEN'), help="ADMIN_TOKEN (modo --url)")
+    args = parser.parse_args()
+
+    if not args.url:
+        from dotenv import load_dotenv
+        load_dotenv()
+
+    started = time.time()
+    if args.url:
+        total = export_from_api(sys.stdout, args.after, args.url, args.token)
+    else:
+        total = export_from_db(sys.stdout, args.after)
+    print(f"✅ {total} labels exportados em {time.time() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
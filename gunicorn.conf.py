@@ -0,0 +1,26 @@
+"""
+Configuração do gunicorn (carregada automaticamente por `gunicorn api:app`)
+
+Com preload_app o api.py é importado UMA vez no master e os workers
+nascem via fork já prontos: boot e restart de worker ficam quase instantâneos.
+
+Workers gthread: cada processo atende GUNICORN_THREADS requests ao mesmo tempo,
+o que permite ao SingleFlight (coalesce.py) juntar lookups idênticos do
+queryLabels dentro do processo. Com o worker sync (1 request por processo)
+o coalescing nunca teria o que juntar.
+"""
+
+import os
+import sys
+
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+
+def post_fork(server, worker):
+    # Estado herdado do master (cliente Bluesky, conexões) não pode ser
+    # compartilhado entre processos: zera tudo no worker recém-criado.
+    api = sys.modules.get('api')
+    if api is not None:
+        api.reset_after_fork()
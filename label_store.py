@@ -0,0 +1,233 @@
+"""
+Réplica local (SQLite em WAL) dos badges DID -> label
+
+O queryLabels passa a ler daqui, sem atravessar a rede até o MySQL.
+Um thread por worker sincroniza incrementalmente usando o maior user_badges.id
+já visto (high-water mark) e, de tempos em tempos, faz uma cópia completa para
+pegar remoções. O high-water mark não enxerga remoções, então /apply-badge e
+/remove-badge chamam refresh_did(), que relê o DID do primário na hora.
+Se o MySQL cair, continuamos servindo o último snapshot.
+
+Ativado com LOCAL_STORE_PATH (ex: /var/data/labels.db).
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+from db import get_db_connection, get_read_connection, recent_write_dids
+
+STORE_PATH = os.getenv('LOCAL_STORE_PATH', '')
+SYNC_INTERVAL = float(os.getenv('LOCAL_STORE_SYNC_INTERVAL', 15))
+FULL_SYNC_INTERVAL = float(os.getenv('LOCAL_STORE_FULL_SYNC_INTERVAL', 300))
+BATCH_SIZE = 5000
+
+SYNC_QUERY = """
+    SELECT ub.id, ubp.bluesky_did, bb.label_id, ub.created_at
+    FROM user_badges ub
+    JOIN bluesky_badges bb ON ub.badge_id = bb.id
+    JOIN user_bluesky_profiles ubp ON ub.user_id = ubp.user_id
+    WHERE ub.id > %s
+    ORDER BY ub.id
+    LIMIT %s
+"""
+
+DID_QUERY = """
+    SELECT ub.id, ubp.bluesky_did, bb.label_id, ub.created_at
+    FROM user_badges ub
+    JOIN bluesky_badges bb ON ub.badge_id = bb.id
+    JOIN user_bluesky_profiles ubp ON ub.user_id = ubp.user_id
+    WHERE ubp.bluesky_did = %s
+"""
+
+_local = threading.local()
+_sync_thread = None
+_sync_lock = threading.Lock()
+
+
+def enabled():
+    return bool(STORE_PATH)
+
+
+def _conn():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(STORE_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS badges (
+                id INTEGER PRIMARY KEY,
+                did TEXT NOT NULL,
+                val TEXT NOT NULL,
+                cts TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS badges_did ON badges (did);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        _local.conn = conn
+    return conn
+
+
+def _get_meta(conn, key, default=None):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def _set_meta(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def format_cts(created_at):
+    """Mesmo formato que o queryLabels sempre usou para o 'cts'"""
+    try:
+        return created_at.isoformat() + "Z"
+    except:
+        return str(created_at)
+
+
+def _fetch_rows(mysql_conn, hwm):
+    """Todas as linhas acima de `hwm`, em páginas de BATCH_SIZE"""
+    rows = []
+    cursor = mysql_conn.cursor()
+    try:
+        while True:
+            cursor.execute(SYNC_QUERY, (hwm, BATCH_SIZE))
+            page = cursor.fetchall()
+            rows.extend(page)
+            if len(page) < BATCH_SIZE:
+                return rows
+            hwm = page[-1][0]
+    finally:
+        cursor.close()
+
+
+def sync_once(full=False):
+    """
+    Puxa do MySQL tudo acima do high-water mark (ou tudo, se full=True).
+    O sync completo lê do primário: uma réplica atrasada traria de volta badges recém removidos.
+    Retorna o número de linhas copiadas.
+    """
+    local = _conn()
+    hwm = 0 if full else int(_get_meta(local, 'high_water_mark', 0))
+
+    # Lê tudo do MySQL ANTES de pegar o lock de escrita do SQLite, para não
+    # segurar o refresh_did() dos writes enquanto a rede trabalha
+    mysql_conn = get_db_connection() if full else get_read_connection()
+    try:
+        rows = _fetch_rows(mysql_conn, hwm)
+    finally:
+        mysql_conn.close()
+
+    # Uma transação só: leitores continuam vendo o snapshot antigo (WAL) até o COMMIT
+    local.execute("BEGIN IMMEDIATE")
+    try:
+        if full:
+            local.execute("DELETE FROM badges")
+        local.executemany(
+            "INSERT OR REPLACE INTO badges (id, did, val, cts) VALUES (?, ?, ?, ?)",
+            [(r[0], r[1], r[2], format_cts(r[3])) for r in rows if r[1] and r[2]]
+        )
+        if rows:
+            hwm = max(hwm, rows[-1][0])
+
+        now = time.time()
+        _set_meta(local, 'high_water_mark', hwm)
+        _set_meta(local, 'last_sync', now)
+        if full:
+            _set_meta(local, 'last_full_sync', now)
+        local.execute("COMMIT")
+    except:
+        local.execute("ROLLBACK")
+        raise
+
+    # Um write pode ter acontecido enquanto líamos: o snapshot acima não pode vencer o refresh dele
+    for did in recent_write_dids():
+        try:
+            refresh_did(did)
+        except Exception as e:
+            print(f"⚠️ Local store: não foi possível atualizar {did}: {e}")
+
+    return len(rows)
+
+
+def refresh_did(did):
+    """
+    Substitui as linhas locais de um DID pelo que está no primário agora
+    (inclusive remoções, que o sync incremental só veria no próximo sync completo).
+    """
+    mysql_conn = get_db_connection()
+    try:
+        cursor = mysql_conn.cursor()
+        cursor.execute(DID_QUERY, (did,))
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        mysql_conn.close()
+
+    local = _conn()
+    local.execute("BEGIN IMMEDIATE")
+    try:
+        local.execute("DELETE FROM badges WHERE did = ?", (did,))
+        local.executemany(
+            "INSERT OR REPLACE INTO badges (id, did, val, cts) VALUES (?, ?, ?, ?)",
+            [(r[0], r[1], r[2], format_cts(r[3])) for r in rows if r[1] and r[2]]
+        )
+        local.execute("COMMIT")
+    except:
+        local.execute("ROLLBACK")
+        raise
+    return len(rows)
+
+
+def _sync_loop():
+    while True:
+        try:
+            local = _conn()
+            now = time.time()
+            # Outro worker pode ter sincronizado agora há pouco (arquivo compartilhado)
+            last_sync = float(_get_meta(local, 'last_sync', 0))
+            last_full = float(_get_meta(local, 'last_full_sync', 0))
+            if now - last_full >= FULL_SYNC_INTERVAL:
+                copied = sync_once(full=True)
+                print(f"🗄️ Local store: sync completo ({copied} badges)")
+            elif now - last_sync >= SYNC_INTERVAL:
+                copied = sync_once()
+                if copied:
+                    print(f"🗄️ Local store: +{copied} badges")
+        except Exception as e:
+            print(f"⚠️ Local store: sync falhou, servindo último snapshot: {e}")
+        time.sleep(SYNC_INTERVAL)
+
+
+def ensure_sync_thread():
+    """Sobe o thread de sync deste processo (lazy: threads não sobrevivem ao fork)"""
+    global _sync_thread
+    if _sync_thread is not None and _sync_thread.is_alive():
+        return
+    with _sync_lock:
+        if _sync_thread is None or not _sync_thread.is_alive():
+            _sync_thread = threading.Thread(target=_sync_loop, name='label-store-sync', daemon=True)
+            _sync_thread.start()
+
+
+def staleness():
+    """Segundos desde o último sync bem-sucedido (None = nunca sincronizou)"""
+    last_sync = _get_meta(_conn(), 'last_sync')
+    return None if last_sync is None else time.time() - float(last_sync)
+
+
+def query(did):
+    """Lista de (val, cts) para um DID a partir do snapshot local"""
+    return _conn().execute("SELECT val, cts FROM badges WHERE did = ?", (did,)).fetchall()
+
+
+def reset_after_fork():
+    global _local, _sync_thread, _sync_lock
+    _local = threading.local()
+    _sync_thread = None
+    _sync_lock = threading.Lock()
@@ -0,0 +1,266 @@
+"""
+Profiling sob demanda da API Flask
+
+- Ligado por PROFILE_ENABLED=1 ou pelo toggle admin (/admin/profiling).
+- Perfila uma amostra dos requests (PROFILE_SAMPLE_RATE, ou por rota via
+  PROFILE_ROUTES="/xrpc/com.atproto.label.queryLabels=0.1,/debug=1") com cProfile
+  e grava os .prof em PROFILE_DIR.
+- Chamadas lentas de SQL/XRPC (acima de PROFILE_SLOW_MS) ficam num buffer circular por
+  processo, espelhado em PROFILE_DIR/slow-<pid>.json para o resumo juntar todos os workers.
+O toggle admin grava PROFILE_DIR/control.json, que todos os workers releem a cada
+CONTROL_REFRESH segundos. O arquivo sobrevive a restarts, então variável de ambiente
+definida explicitamente sempre vence: com PROFILE_ENABLED=0 o toggle antigo não religa nada.
+Desligado, o custo por request é uma comparação de tempo e um if.
+"""
+
+import os
+import json
+import time
+import random
+import pstats
+import cProfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/diva-profiles')
+CONTROL_FILE = os.path.join(PROFILE_DIR, 'control.json')
+CONTROL_REFRESH = 2.0
+MAX_PROFILES = 200
+
+
+def _parse_routes(raw):
+    routes = {}
+    for item in raw.split(','):
+        route, _, rate = item.strip().partition('=')
+        if route and rate:
+            routes[route] = float(rate)
+    return routes
+
+
+config = {
+    'enabled': os.getenv('PROFILE_ENABLED', '0') == '1',
+    'sample_rate': float(os.getenv('PROFILE_SAMPLE_RATE', 0.01)),
+    'routes': _parse_routes(os.getenv('PROFILE_ROUTES', '')),
+    'slow_ms': float(os.getenv('PROFILE_SLOW_MS', 100)),
+}
+
+_ENV_VARS = {
+    'enabled': 'PROFILE_ENABLED',
+    'sample_rate': 'PROFILE_SAMPLE_RATE',
+    'routes': 'PROFILE_ROUTES',
+    'slow_ms': 'PROFILE_SLOW_MS',
+}
+# Chaves fixadas pelo ambiente: nem o control.json nem o toggle admin as alteram
+pinned = {key for key, var in _ENV_VARS.items() if var in os.environ}
+
+_slow_calls = deque(maxlen=500)
+_lock = threading.Lock()
+_next_refresh = 0.0
+
+
+def _rate(name, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 1:
+        raise ValueError(f"'{name}' deve ser um número entre 0 e 1")
+    return float(value)
+
+
+def validate(changes):
+    """Confere e normaliza as chaves da config; levanta ValueError na primeira inválida"""
+    clean = {}
+    for key, value in changes.items():
+        if key == 'enabled':
+            if not isinstance(value, bool):
+                raise ValueError("'enabled' deve ser true ou false")
+        elif key == 'sample_rate':
+            value = _rate(key, value)
+        elif key == 'slow_ms':
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError("'slow_ms' deve ser um número >= 0")
+            value = float(value)
+        elif key == 'routes':
+            if not isinstance(value, dict) or not all(isinstance(route, str) for route in value):
+                raise ValueError("'routes' deve ser um objeto {rota: sample_rate}")
+            value = {route: _rate(f"routes[{route}]", rate) for route, rate in value.items()}
+        else:
+            raise ValueError(f"chave desconhecida: '{key}'")
+        clean[key] = value
+    return clean
+
+
+def _apply(changes):
+    config.update({k: v for k, v in changes.items() if k in config and k not in pinned})
+
+
+def _refresh_config():
+    global _next_refresh
+    _next_refresh = time.monotonic() + CONTROL_REFRESH
+    try:
+        with open(CONTROL_FILE) as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError('esperado um objeto JSON')
+        # Valida o arquivo inteiro antes de aplicar: um valor ruim não pode derrubar todos os requests
+        _apply(validate(data))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"⚠️ Profiler: control.json inválido, ignorado: {e}")
+
+
+def set_config(**changes):
+    """
+    Atualiza a config e grava o control.json para os outros workers (chaves fixadas
+    pelo ambiente ficam como estão). Levanta ValueError com valor inválido, sem aplicar nada.
+    """
+    _apply(validate({k: v for k, v in changes.items() if v is not None}))
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tmp = CONTROL_FILE + f".{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(config, f)
+    os.replace(tmp, CONTROL_FILE)
+    return config
+
+
+def _sample_rate(route):
+    return config['routes'].get(route, config['sample_rate'])
+
+
+def _before_request():
+    if time.monotonic() >= _next_refresh:
+        _refresh_config()
+    if not config['enabled']:
+        return
+    route = request.url_rule.rule if request.url_rule else request.path
+    if random.random() >= _sample_rate(route):
+        return
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        # Outro request deste processo já está sendo perfilado
+        return
+    g._profile = (route, prof, time.perf_counter())
+
+
+def _after_request(response):
+    state = g.pop('_profile', None)
+    if state is None:
+        return response
+    route, prof, started = state
+    prof.disable()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        safe_route = route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'root'
+        path = os.path.join(PROFILE_DIR, f"{safe_route}-{int(time.time() * 1000)}-{os.getpid()}-{elapsed_ms:.0f}ms.prof")
+        prof.dump_stats(path)
+        _prune()
+    except Exception as e:
+        print(f"⚠️ Profiler: falha ao gravar profile: {e}")
+    return response
+
+
+def _prune():
+    files = sorted(_profile_files(), key=os.path.getmtime)
+    for path in files[:-MAX_PROFILES]:
+        os.remove(path)
+
+
+def _profile_files():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return [os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR) if f.endswith('.prof')]
+
+
+def install(app):
+    """Registra os hooks before/after_request no app"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+
+@contextmanager
+def timed(kind, name):
+    """Marca uma chamada SQL/XRPC; registra se passar de PROFILE_SLOW_MS (só com profiling ligado)"""
+    if not config['enabled']:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms >= config['slow_ms']:
+            with _lock:
+                _slow_calls.append({
+                    'kind': kind,
+                    'name': name,
+                    'ms': round(elapsed_ms, 1),
+                    'at': time.time(),
+                    'path': request.path if has_request_context() else None,
+                })
+                snapshot = list(_slow_calls)
+            _save_slow_calls(snapshot)
+
+
+def _save_slow_calls(calls):
+    """Espelha o buffer deste processo em disco (o GET pode cair em outro worker)"""
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"slow-{os.getpid()}.json")
+        with open(path + '.tmp', 'w') as f:
+            json.dump(calls, f)
+        os.replace(path + '.tmp', path)
+    except Exception as e:
+        print(f"⚠️ Profiler: falha ao gravar chamadas lentas: {e}")
+
+
+def _load_slow_calls():
+    """Chamadas lentas de todos os workers (arquivos slow-<pid>.json)"""
+    calls = []
+    if not os.path.isdir(PROFILE_DIR):
+        return calls
+    for name in os.listdir(PROFILE_DIR):
+        if name.startswith('slow-') and name.endswith('.json'):
+            try:
+                with open(os.path.join(PROFILE_DIR, name)) as f:
+                    calls.extend(json.load(f))
+            except Exception:
+                pass
+    return calls
+
+
+def summary(limit=20, route=None):
+    """Top funções (tempo cumulativo) somando os profiles gravados + chamadas lentas"""
+    files = _profile_files()
+    if route:
+        safe_route = route.strip('/').replace('/', '_')
+        files = [f for f in files if os.path.basename(f).startswith(safe_route + '-')]
+
+    hot = []
+    if files:
+        stats = pstats.Stats(files[0])
+        for path in files[1:]:
+            stats.add(path)
+        entries = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:limit]
+        for (filename, line, func), (cc, nc, tt, ct, callers) in entries:
+            hot.append({
+                'function': f"{os.path.basename(filename)}:{line}({func})",
+                'calls': nc,
+                'tottime_ms': round(tt * 1000, 2),
+                'cumtime_ms': round(ct * 1000, 2),
+            })
+
+    slow = sorted(_load_slow_calls(), key=lambda c: c['ms'], reverse=True)[:limit]
+
+    return {
+        'config': config,
+        'pinned_by_env': sorted(pinned),
+        'profiles': len(files),
+        'profile_dir': PROFILE_DIR,
+        'hot_functions': hot,
+        'slow_calls': slow,
+    }
@@ -0,0 +1,327 @@
+"""
+Pool de contas escritoras do Labeler (sharding de escrita)
+
+Uma conta só fica limitada pelo rate limit de escrita do PDS dela. Com
+LABELER_WRITERS (JSON) as escritas são distribuídas entre várias contas:
+
+    LABELER_WRITERS='[{"handle": "w1.boio.la", "password": "..."},
+                      {"handle": "w2.boio.la", "password": "...", "pds": "https://pds.exemplo/xrpc",
+                       "quota_per_hour": 1500}]'
+
+- Hash consistente (com nós virtuais) pelo DID do sujeito: o mesmo DID sempre cai
+  na mesma conta, e adicionar/remover uma conta só remapeia ~1/N dos DIDs.
+- Ordem por DID: escritas do mesmo DID são serializadas (lock por DID), inclusive
+  quando há failover para outra conta.
+- Saúde e cota por conta: só 429, 5xx e erros de rede tiram a conta do ar (com backoff);
+  4xx e erros locais (badge inválido, validação, senha faltando) são do request, não da
+  conta. Conta fora do ar ou com a cota horária estourada pula para a próxima do anel.
+- A reserva na cota é devolvida se a escrita falhar (só escrita aceita pelo PDS conta).
+Com failover, records de um mesmo DID podem ficar em repos diferentes: o
+compact_labels.py compacta todos os repos juntos (repo principal + LABELER_WRITERS).
+O record é gravado no repo da conta escritora, mas o `src` é sempre o DID do labeler.
+Cotas e saúde ficam num SQLite em WRITER_STATE_PATH (por padrão o mesmo arquivo de
+DB_STICKY_PATH), compartilhado por todos os workers do gunicorn; só o client
+(sessão logada) é por processo.
+Sem LABELER_WRITERS, o pool tem uma conta só: o get_client() de sempre, que é
+tentado mesmo fora do ar ou sem cota (não há outra conta para onde desviar).
+"""
+
+import os
+import json
+import time
+import bisect
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+VIRTUAL_NODES = 64
+DEFAULT_QUOTA_PER_HOUR = int(os.getenv('WRITER_QUOTA_PER_HOUR', 1600))
+BASE_BACKOFF = 5.0
+MAX_BACKOFF = 300.0
+LOCK_STRIPES = 1024
+STATE_PATH = os.getenv('WRITER_STATE_PATH') or os.getenv(
+    'DB_STICKY_PATH', os.path.join(tempfile.gettempdir(), 'diva-recent-writes.db'))
+
+
+class WriterPoolExhausted(RuntimeError):
+    """Nenhuma conta saudável e com cota disponível"""
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], 'big')
+
+
+# Nomes das exceções de rede/timeout do atproto (NetworkError, InvokeTimeoutError) e do httpx
+_NETWORK_ERRORS = {'NetworkError', 'InvokeTimeoutError', 'ConnectError', 'TimeoutException'}
+_SESSION_ERRORS = {'ExpiredToken', 'InvalidToken'}
+
+
+def _status_code(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def _is_network_error(error):
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in _NETWORK_ERRORS for cls in type(error).__mro__)
+
+
+def _is_session_error(error):
+    status = _status_code(error)
+    if status == 401:
+        return True
+    content = getattr(getattr(error, 'response', None), 'content', None)
+    return status == 400 and getattr(content, 'error', None) in _SESSION_ERRORS
+
+
+class WriterState:
+    """Cota (escritas da última hora) e saúde das contas, num SQLite compartilhado entre processos"""
+
+    def __init__(self, path=None):
+        self.path = path or STATE_PATH
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS writer_writes (
+                    handle TEXT NOT NULL,
+                    written_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS writer_writes_handle ON writer_writes (handle, written_at);
+                CREATE TABLE IF NOT EXISTS writer_health (
+                    handle TEXT PRIMARY KEY,
+                    down_until REAL NOT NULL DEFAULT 0,
+                    failures INTEGER NOT NULL DEFAULT 0,
+                    total_writes INTEGER NOT NULL DEFAULT 0,
+                    total_errors INTEGER NOT NULL DEFAULT 0
+                );
+            """)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE: ler e atualizar a cota é atômico entre workers"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def health(conn, handle):
+        conn.execute("INSERT OR IGNORE INTO writer_health (handle) VALUES (?)", (handle,))
+        return conn.execute(
+            "SELECT down_until, failures, total_writes, total_errors FROM writer_health WHERE handle = ?",
+            (handle,)
+        ).fetchone()
+
+    @staticmethod
+    def writes_last_hour(conn, handle, now):
+        # Limpa as escritas com mais de uma hora para a tabela não crescer sem limite
+        conn.execute("DELETE FROM writer_writes WHERE handle = ? AND written_at <= ?", (handle, now - 3600))
+        return conn.execute("SELECT COUNT(*) FROM writer_writes WHERE handle = ?", (handle,)).fetchone()[0]
+
+
+class WriterAccount:
+    def __init__(self, handle, password=None, pds=None, quota_per_hour=DEFAULT_QUOTA_PER_HOUR,
+                 client_factory=None, state=None):
+        self.handle = handle
+        self.password = password
+        self.pds = pds
+        self.quota_per_hour = quota_per_hour
+        self._client_factory = client_factory
+        self._client = None
+        self._lock = threading.Lock()
+        self.state = state or WriterState()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                if self._client_factory:
+                    self._client = self._client_factory()
+                else:
+                    from atproto import Client
+
+                    client = Client(base_url=self.pds) if self.pds else Client()
+                    client.login(self.handle, self.password)
+                    print(f"✅ Writer logado: {self.handle} ({client.me.did})")
+                    self._client = client
+            return self._client
+
+    def reserve(self, now):
+        """
+        Reserva uma escrita na cota (atômico entre workers): id da reserva, ou None se a
+        conta não pode escrever agora
+        """
+        with self.state.transaction() as conn:
+            down_until = self.state.health(conn, self.handle)[0]
+            if now < down_until or self.state.writes_last_hour(conn, self.handle, now) >= self.quota_per_hour:
+                return None
+            return conn.execute(
+                "INSERT INTO writer_writes (handle, written_at) VALUES (?, ?)", (self.handle, now)
+            ).lastrowid
+
+    def release(self, reservation):
+        """Devolve a reserva de uma escrita que o PDS não aceitou"""
+        with self.state.transaction() as conn:
+            conn.execute("DELETE FROM writer_writes WHERE rowid = ?", (reservation,))
+
+    def record_success(self):
+        with self.state.transaction() as conn:
+            self.state.health(conn, self.handle)
+            conn.execute(
+                "UPDATE writer_health SET failures = 0, total_writes = total_writes + 1 WHERE handle = ?",
+                (self.handle,)
+            )
+
+    def record_failure(self, error):
+        status = _status_code(error)
+        with self.state.transaction() as conn:
+            down_until, failures = self.state.health(conn, self.handle)[:2]
+            if status == 429:
+                # Rate limit do PDS: fora até o reset (ou 60s)
+                headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+                reset = headers.get('ratelimit-reset') or headers.get('RateLimit-Reset')
+                down_until = float(reset) if reset else time.time() + 60
+            elif (status is not None and status >= 500) or (status is None and _is_network_error(error)):
+                failures += 1
+                down_until = time.time() + min(BASE_BACKOFF * 2 ** (failures - 1), MAX_BACKOFF)
+            # Demais erros (4xx, validação, config) são do request: a conta continua saudável
+            conn.execute(
+                "UPDATE writer_health SET down_until = ?, failures = ?, total_errors = total_errors + 1 "
+                "WHERE handle = ?",
+                (down_until, failures, self.handle)
+            )
+        if _is_session_error(error):
+            # Sessão expirada/inválida: força novo login (o client é por processo)
+            with self._lock:
+                self._client = None
+
+    def status(self, now):
+        with self.state.transaction() as conn:
+            down_until, _, total_writes, total_errors = self.state.health(conn, self.handle)
+            writes_last_hour = self.state.writes_last_hour(conn, self.handle, now)
+        return {
+            'handle': self.handle,
+            'healthy': now >= down_until,
+            'down_for': max(0.0, round(down_until - now, 1)),
+            'writes_last_hour': writes_last_hour,
+            'quota_per_hour': self.quota_per_hour,
+            'total_writes': total_writes,
+            'total_errors': total_errors,
+        }
+
+
+class WriterPool:
+    def __init__(self, accounts, virtual_nodes=VIRTUAL_NODES):
+        if not accounts:
+            raise ValueError('WriterPool precisa de pelo menos uma conta')
+        self.accounts = accounts
+        self._ring = sorted(
+            (_hash(f"{account.handle}#{i}"), idx)
+            for idx, account in enumerate(accounts)
+            for i in range(virtual_nodes)
+        )
+        self._ring_keys = [h for h, _ in self._ring]
+        self._did_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def candidates(self, did):
+        """Contas na ordem do anel a partir do hash do DID (a primeira é a 'dona' do DID)"""
+        start = bisect.bisect(self._ring_keys, _hash(did)) % len(self._ring)
+        seen = []
+        for i in range(len(self._ring)):
+            idx = self._ring[(start + i) % len(self._ring)][1]
+            if idx not in seen:
+                seen.append(idx)
+                if len(seen) == len(self.accounts):
+                    break
+        return [self.accounts[idx] for idx in seen]
+
+    @contextmanager
+    def session_for(self, did):
+        """
+        Entrega o client da conta responsável pelo DID, segurando o lock do DID
+        durante a escrita. 429, 5xx e erros de rede dentro do bloco contam contra a
+        saúde da conta.
+        """
+        with self._did_locks[_hash(did) % LOCK_STRIPES]:
+            now = time.time()
+            account, reservation = None, None
+            for candidate in self.candidates(did):
+                reservation = candidate.reserve(now)
+                if reservation is not None:
+                    account = candidate
+                    break
+            if account is None:
+                if len(self.accounts) > 1:
+                    raise WriterPoolExhausted('Nenhuma conta escritora disponível (saúde/cota)')
+                # Uma conta só: não há para onde desviar, então tenta (quem decide é o PDS)
+                account = self.accounts[0]
+
+            try:
+                client = account.client()
+                yield client
+            except Exception as e:
+                if reservation is not None:
+                    account.release(reservation)
+                account.record_failure(e)
+                raise
+            account.record_success()
+
+    def status(self):
+        now = time.time()
+        return [account.status(now) for account in self.accounts]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def load_accounts(default_client_factory=None):
+    """Contas de LABELER_WRITERS; sem ela, uma conta só usando o client padrão"""
+    raw = os.getenv('LABELER_WRITERS')
+    state = WriterState()
+    if not raw:
+        return [WriterAccount(
+            os.getenv('BLUESKY_HANDLE', 'labeler.boio.la'),
+            client_factory=default_client_factory,
+            state=state
+        )]
+    return [
+        WriterAccount(
+            entry['handle'],
+            entry.get('password'),
+            pds=entry.get('pds'),
+            quota_per_hour=int(entry.get('quota_per_hour', DEFAULT_QUOTA_PER_HOUR)),
+            state=state
+        )
+        for entry in json.loads(raw)
+    ]
+
+
+def get_pool(default_client_factory=None):
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WriterPool(load_accounts(default_client_factory))
+                print(f"✍️ Writer pool: {len(_pool.accounts)} conta(s)")
+    return _pool
+
+
+def reset_after_fork():
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()